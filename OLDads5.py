@@ -1,47 +1,44 @@
 import os
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import streamlit as st
-import base64
 from io import BytesIO
+from font_registry import get_font
+from text_fit import MAX_FONT_SIZE, MIN_FONT_SIZE, fit_font_size, measure_text_size
+from image_cache import largest_dimensions, source_cache
+from instrumentation import count, stage, start_job
+from layout_templates import position_placement
+from metrics_panel import metrics_toggle, show_metrics
+from logo_assets import get_logo_asset
+from parallel_render import default_workers, parallel_map
+from zip_export import ZipExport
+from variant_planner import describe_plan, plan_variants, position_layouts
 
 DEFAULT_FONT_PATH = "arial.ttf"
 
-def calculate_font_size(draw, text, img_width, img_height, width_percentage, height_percentage):
+def calculate_font_size(draw, text, img_width, img_height, width_percentage, height_percentage, min_size=MIN_FONT_SIZE, max_size=MAX_FONT_SIZE):
     max_width = img_width * width_percentage
     max_height = img_height * height_percentage
 
-    # Start with an initial guess for font size
-    font_size = 1
-    font = ImageFont.truetype(DEFAULT_FONT_PATH, font_size)
+    # Largest font size that keeps the text inside the box, found in logarithmic steps
+    return fit_font_size(text, max_width, max_height, DEFAULT_FONT_PATH, min_size, max_size)
 
-    # Increase font size until the text exceeds width or height constraints
-    while True:
-        text_width, text_height = draw.textsize(text, font=font)
-        if text_width > max_width or text_height > max_height:
-            break
-        font_size += 1
-        font = ImageFont.truetype(DEFAULT_FONT_PATH, font_size)
-
-    # Return the last valid font size
-    return font_size - 1
-
-def merge_text_with_image(image, call_to_action_text, description_text, width_percentages, height_percentages, text_colors, bg_colors, cta_position, desc_position, logo_position, logo_width_percentage, logo_height_percentage, uploaded_logo):
+def merge_text_with_image(image, call_to_action_text, description_text, width_percentages, height_percentages, text_colors, bg_colors, cta_position, desc_position, logo_position, logo_width_percentage, logo_height_percentage, uploaded_logo, font_size_range=(MIN_FONT_SIZE, MAX_FONT_SIZE)):
     img = image.copy()
     draw = ImageDraw.Draw(img)
     img_width, img_height = img.size
 
     # Calculate font size based on height and adjust for width
-    font_size_cta = calculate_font_size(draw, call_to_action_text, img_width, img_height, width_percentages[0], height_percentages[0])
-    font_size_desc = calculate_font_size(draw, description_text, img_width, img_height, width_percentages[1], height_percentages[1])
-    font_cta = ImageFont.truetype(DEFAULT_FONT_PATH, font_size_cta)
-    font_desc = ImageFont.truetype(DEFAULT_FONT_PATH, font_size_desc)
+    font_size_cta = calculate_font_size(draw, call_to_action_text, img_width, img_height, width_percentages[0], height_percentages[0], *font_size_range)
+    font_size_desc = calculate_font_size(draw, description_text, img_width, img_height, width_percentages[1], height_percentages[1], *font_size_range)
+    font_cta = get_font(font_size_cta, DEFAULT_FONT_PATH)
+    font_desc = get_font(font_size_desc, DEFAULT_FONT_PATH)
 
     # Position for call to action text
-    text_width_cta, text_height_cta = draw.textsize(call_to_action_text, font=font_cta)
+    text_width_cta, text_height_cta = measure_text_size(call_to_action_text, font_size_cta, DEFAULT_FONT_PATH)
     x_cta, y_cta = get_position_coordinates(cta_position, img_width, img_height, text_width_cta, text_height_cta)
 
     # Position for description text
-    text_width_desc, text_height_desc = draw.textsize(description_text, font=font_desc)
+    text_width_desc, text_height_desc = measure_text_size(description_text, font_size_desc, DEFAULT_FONT_PATH)
     x_desc, y_desc = get_position_coordinates(desc_position, img_width, img_height, text_width_desc, text_height_desc)
 
     # Draw the background rectangles and texts
@@ -58,43 +55,17 @@ def merge_text_with_image(image, call_to_action_text, description_text, width_pe
     return img
 
 def get_position_coordinates(position, img_width, img_height, text_width, text_height, y_offset=0):
-    if position == "top-left":
-        x = 10
-        y = 10 + y_offset
-    elif position == "top-center":
-        x = (img_width - text_width) // 2
-        y = 10 + y_offset
-    elif position == "top-right":
-        x = img_width - text_width - 10
-        y = 10 + y_offset
-    elif position == "middle-left":
-        x = 10
-        y = (img_height - text_height) // 2 + y_offset
-    elif position == "middle-center":
-        x = (img_width - text_width) // 2
-        y = (img_height - text_height) // 2 + y_offset
-    elif position == "middle-right":
-        x = img_width - text_width - 10
-        y = (img_height - text_height) // 2 + y_offset
-    elif position == "bottom-left":
-        x = 10
-        y = img_height - text_height - 10 + y_offset
-    elif position == "bottom-center":
-        x = (img_width - text_width) // 2
-        y = img_height - text_height - 10 + y_offset
-    elif position == "bottom-right":
-        x = img_width - text_width - 10
-        y = img_height - text_height - 10 + y_offset
-    return x, y
+    # Placement table compiled once per position and image size
+    x, y = position_placement(position, (img_width, img_height)).place((text_width, text_height))
+    return x, y + y_offset
 
 def overlay_logo(image, uploaded_logo, logo_position, img_width, img_height, logo_width_percentage, logo_height_percentage):
     img = image.convert("RGBA")  # Ensure the image is in RGBA mode
-    logo = Image.open(uploaded_logo).convert("RGBA")  # Open the logo image and ensure it's in RGBA mode
-
     logo_width = int(img_width * logo_width_percentage)
     logo_height = int(img_height * logo_height_percentage)
 
-    logo = logo.resize((logo_width, logo_height), Image.ANTIALIAS)
+    # Decoded once per upload, scaled once per box size
+    logo = get_logo_asset(uploaded_logo).scaled((logo_width, logo_height))
 
     x, y = get_position_coordinates(logo_position, img_width, img_height, logo_width, logo_height)
 
@@ -103,20 +74,50 @@ def overlay_logo(image, uploaded_logo, logo_position, img_width, img_height, log
 
     return img.convert("RGB")
 
-def download_images(images_with_text, selected_image_sizes):
+def render_variant_task(task, context):
+    image_index, cta_position, desc_position, logo_position, call_to_action_text, description_text = task
+    img = source_cache.get_source(context['images'][image_index], context['decode_size'])
+    count("variants_rendered")
+    with stage("draw"):
+        return merge_text_with_image(
+            img,
+            call_to_action_text,
+            description_text,
+            context['width_percentages'],
+            context['height_percentages'],
+            context['text_colors'],
+            context['bg_colors'],
+            cta_position,
+            desc_position,
+            logo_position,
+            context['logo_width_percentage'],
+            context['logo_height_percentage'],
+            context['logo'],
+            context['font_size_range']
+        )
+
+def download_images(images_with_text, selected_image_sizes, export):
     for idx, image in enumerate(images_with_text):
+        # A size selected under several channels is resized and encoded once
+        encoded = {}
         for channel, label, dimensions in selected_image_sizes:
-            image_resized = image.resize(dimensions, Image.ANTIALIAS)
+            if (label, dimensions) not in encoded:
+                with stage("resize"):
+                    image_resized = image.resize(dimensions, Image.LANCZOS)
+                buffered = BytesIO()
+                with stage("encode"):
+                    image_resized.save(buffered, format="PNG")
+                count("encoded_bytes", buffered.tell())
+                encoded[(label, dimensions)] = image_resized, buffered.getvalue()
+            image_resized, data = encoded[(label, dimensions)]
             st.image(image_resized, caption=f"Image {idx + 1} - Channel: {channel}, Size: {label}", use_column_width=False)
 
-            buffered = BytesIO()
-            image_resized.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            href = f'<a href="data:file/png;base64,{img_str}" download="image_{idx + 1}_{channel}_{label}.png">Download Image</a>'
-            st.markdown(href, unsafe_allow_html=True)
+            with stage("zip"):
+                export.add_variant(channel, label, f"image_{idx + 1}_{channel}_{label}.png", data)
 
 def main():
     st.title("Image Text and Logo Overlay App")
+    collect_metrics = metrics_toggle()
 
     uploaded_images = st.file_uploader("Upload multiple images", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
     uploaded_logo = st.file_uploader("Upload logo image", type=["jpg", "jpeg", "png"])
@@ -138,6 +139,7 @@ def main():
     height_percentage_cta = st.slider("Call to Action Height (Percentage of Image Height)", 1, 100, 10, step=1) / 100.0
     width_percentage_desc = st.slider("Description Width (Percentage of Image Width)", 1, 100, 50, step=1) / 100.0
     height_percentage_desc = st.slider("Description Height (Percentage of Image Height)", 1, 100, 10, step=1) / 100.0
+    font_size_range = st.slider("Font Size Range", MIN_FONT_SIZE, MAX_FONT_SIZE, (MIN_FONT_SIZE, MAX_FONT_SIZE), step=1)
 
     selected_cta_positions = st.multiselect("Select Call to Action Text Positions", ["top-left", "top-center", "top-right", "middle-left", "middle-center", "middle-right", "bottom-left", "bottom-center", "bottom-right"])
     selected_desc_positions = st.multiselect("Select Description Text Positions", ["top-left", "top-center", "top-right", "middle-left", "middle-center", "middle-right", "bottom-left", "bottom-center", "bottom-right"])
@@ -182,35 +184,62 @@ def main():
                 if st.checkbox(label, key=f"{channel}_{label}"):
                     selected_image_sizes.append((channel, label, dimensions))
 
-    if st.button("Merge and Download"):
-        if uploaded_images and selected_cta_positions and selected_desc_positions and selected_logo_positions:
+    parallel_rendering = st.checkbox("Render in parallel", value=True)
+    workers = default_workers() if parallel_rendering else 1
+
+    # Only layouts where CTA, description and logo each get their own spot are rendered
+    layouts = position_layouts(selected_cta_positions, selected_desc_positions, selected_logo_positions)
+    # Each layout is rendered once at the largest size and resized to every selected size
+    decode_size = largest_dimensions(dimensions for _, _, dimensions in selected_image_sizes)
+    plan = plan_variants(len(uploaded_images or []), len(call_to_action_texts), len(layouts),
+                         [dimensions for _, _, dimensions in selected_image_sizes],
+                         render_size=decode_size, workers=workers)
+    st.caption(f"Planned: {describe_plan(plan)}")
+    for problem in plan['over_limits']:
+        st.error(f"Too many variants: {problem}. Select fewer positions, texts or sizes.")
+
+    if st.button("Merge and Download", disabled=bool(plan['over_limits'])):
+        if uploaded_images and layouts:
             st.write("Processing images...")
-            images_with_text = []
-            for image in uploaded_images:
-                img = Image.open(image)
-                for cta_position in selected_cta_positions:
-                    for desc_position in selected_desc_positions:
-                        for logo_position in selected_logo_positions:
-                            if cta_position != desc_position and cta_position != logo_position and desc_position != logo_position:
-                                for call_to_action_text, description_text in zip(call_to_action_texts, description_texts):
-                                    merged_img = merge_text_with_image(
-                                        img,
-                                        call_to_action_text,
-                                        description_text,
-                                        [width_percentage_cta, width_percentage_desc],
-                                        [height_percentage_cta, height_percentage_desc],
-                                        [call_to_action_text_color, description_text_color],
-                                        [call_to_action_bg_color, description_bg_color],
-                                        cta_position,
-                                        desc_position,
-                                        logo_position,
-                                        logo_width_percentage,
-                                        logo_height_percentage,
-                                        uploaded_logo
-                                    )
-                                    images_with_text.append(merged_img)
-            download_images(images_with_text, selected_image_sizes)
+            job_metrics = start_job("OLDads5") if collect_metrics else None
+            tasks = []
+            for image_index in range(len(uploaded_images)):
+                for cta_position, desc_position, logo_position in layouts:
+                    for call_to_action_text, description_text in zip(call_to_action_texts, description_texts):
+                        tasks.append((image_index, cta_position, desc_position, logo_position, call_to_action_text, description_text))
+
+            context = {
+                'images': [BytesIO(image.getvalue()) for image in uploaded_images],
+                'logo': BytesIO(uploaded_logo.getvalue()) if uploaded_logo else None,
+                'width_percentages': [width_percentage_cta, width_percentage_desc],
+                'height_percentages': [height_percentage_cta, height_percentage_desc],
+                'text_colors': [call_to_action_text_color, description_text_color],
+                'bg_colors': [call_to_action_bg_color, description_bg_color],
+                'logo_width_percentage': logo_width_percentage,
+                'logo_height_percentage': logo_height_percentage,
+                'font_size_range': font_size_range,
+                # Variants are resized to each selected size afterwards, so decode no larger than the biggest
+                'decode_size': decode_size,
+            }
+
+            progress_bar = st.progress(0.0, text="Rendering variants...")
+            def report_progress(done, total):
+                progress_bar.progress(done / total, text=f"Rendered {done} of {total} variants")
+
+            # Streamlit runs this script as __main__, so workers import the task function by name
+            results, errors = parallel_map("OLDads5:render_variant_task", tasks, context, workers=workers, progress=report_progress)
+            for index, message in errors:
+                st.error(f"Variant {index + 1} failed: {message}")
+            images_with_text = [merged_img for merged_img in results if merged_img is not None]
+            with ZipExport() as export:
+                download_images(images_with_text, selected_image_sizes, export)
+                st.download_button("Download all", data=export.finish(), file_name="images.zip", mime="application/zip")
             st.write("Images processed and available for download!")
+            if job_metrics is not None:
+                st.session_state['render_metrics'] = job_metrics.finish()
+
+    if collect_metrics:
+        show_metrics()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,18 @@
 import os
-from PIL import Image, ImageDraw, ImageFont
+from PIL import ImageDraw
 import streamlit as st
-import base64
 from io import BytesIO
+from font_registry import get_font
+from image_cache import largest_dimensions, source_cache
+from render_pipeline import pipeline_map
+from text_fit import measure_text_size
+from zip_export import ZipExport, archive_path
 
 def merge_text_with_image(image, text, font_size, text_color, bg_color, position, position_mapping):
     img = image.copy()
     draw = ImageDraw.Draw(img)
-    font = ImageFont.truetype("arial.ttf", font_size)
-    text_width, text_height = draw.textsize(text, font=font)
+    font = get_font(font_size)
+    text_width, text_height = measure_text_size(text, font_size)
 
     if position == "bottom-center":
         img_width, img_height = img.size
@@ -42,14 +46,18 @@ def merge_text_with_image(image, text, font_size, text_color, bg_color, position
     return img
 
 
-def download_images(images_with_text, text_idx, image_size, font_size):
-    for idx, image in enumerate(images_with_text):
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        href = f'<a href="data:file/png;base64,{img_str}" download="text_image_{text_idx}_{image_size}_font_size_{font_size}.png">Download Image {idx + 1}</a>'
-        st.markdown(href, unsafe_allow_html=True)
-        st.image(image, caption=f"Text {text_idx + 1} - Image {idx + 1} - Font Size {font_size}", use_column_width=True)
+def encode_png(image):
+    buffered = BytesIO()
+    image.save(buffered, format="PNG")
+    return image.size, buffered.getvalue()
+
+
+def download_image(encoded, text_idx, idx, font_size, export):
+    (width, height), data = encoded
+    # thumbnail() keeps the aspect ratio, so folder by the size actually produced
+    size_folder = f"{width}x{height}"
+    export.add(archive_path(size_folder, f"text_image_{text_idx}_font_size_{font_size}_{export.count + 1}.png"), data)
+    st.image(data, caption=f"Text {text_idx + 1} - Image {idx + 1} - Font Size {font_size}", use_column_width=True)
 
 def main():
     st.title("Image Text Overlay App")
@@ -105,24 +113,42 @@ def main():
     "center": ("center", "center"),
 }
 
+    # Fill each size exactly, cropped around the photo's subject, instead of fitting inside it
+    crop_to_size = st.checkbox("Smart crop to each size")
+
     if st.button("Merge and Download"):
         if uploaded_images:
-            for text_idx, text in enumerate(texts):
-                for font_size in font_sizes:
-                    images_with_text = []
-                    for image in uploaded_images:
-                        img = Image.open(image)
-                        for position in selected_positions:
-                            for selected_size in selected_image_sizes:
-                                image_size = image_sizes[selected_size]
-                                resized_img = img.copy()
-                                resized_img.thumbnail(image_size)
-                                for text_color in text_colors:
-                                    for bg_color in bg_colors:
-                                        merged_img = merge_text_with_image(resized_img, text, font_size, text_color, bg_color, position, position_mapping)
-                                        images_with_text.append(merged_img)
-
-                    download_images(images_with_text, text_idx, selected_size, font_size)
+            with ZipExport() as export:
+                decode_size = largest_dimensions(image_sizes[size] for size in selected_image_sizes)
+                # One task per output image, in archive order; idx numbers the images of one text and font size
+                tasks = []
+                for text_idx, text in enumerate(texts):
+                    for font_size in font_sizes:
+                        idx = 0
+                        for image in uploaded_images:
+                            for position in selected_positions:
+                                for selected_size in selected_image_sizes:
+                                    for text_color in text_colors:
+                                        for bg_color in bg_colors:
+                                            tasks.append((text_idx, idx, text, font_size, image, position,
+                                                          image_sizes[selected_size], text_color, bg_color))
+                                            idx += 1
+
+                def draw(task):
+                    _, _, text, font_size, image, position, image_size, text_color, bg_color = task
+                    resized_img = source_cache.get_thumbnail(image, image_size, decode_size=decode_size, crop=crop_to_size)
+                    return merge_text_with_image(resized_img, text, font_size, text_color, bg_color, position, position_mapping)
+
+                # Images are drawn, encoded and shown as a pipeline, so the first ones appear while the rest render
+                def publish(index, encoded):
+                    text_idx, idx, _, font_size = tasks[index][:4]
+                    download_image(encoded, text_idx, idx, font_size, export)
+
+                errors = pipeline_map(tasks, [("draw", draw), ("encode", encode_png)], publish)
+                for index, message in errors:
+                    st.error(f"Image {index + 1} failed: {message}")
+
+                st.download_button(f"Download all ({export.count} images)", data=export.finish(), file_name="text_images.zip", mime="application/zip")
 
 if __name__ == "__main__":
     main()
@@ -1,16 +1,20 @@
 import os
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import streamlit as st
-import base64
 from io import BytesIO
+from font_registry import get_font
+from image_cache import largest_dimensions, source_cache
+from render_pipeline import pipeline_map
+from text_fit import measure_text_size
+from zip_export import ZipExport, archive_path
 
 DEFAULT_FONT_PATH = "arial.ttf"
 
 def merge_text_with_image(image, text, font_size, text_color, bg_color, position, position_mapping):
     img = image.copy()
     draw = ImageDraw.Draw(img)
-    font = ImageFont.truetype(DEFAULT_FONT_PATH, font_size)
-    text_width, text_height = draw.textsize(text, font=font)
+    font = get_font(font_size, DEFAULT_FONT_PATH)
+    text_width, text_height = measure_text_size(text, font_size, DEFAULT_FONT_PATH)
 
     if position == "bottom-center":
         img_width, img_height = img.size
@@ -43,18 +47,20 @@ def merge_text_with_image(image, text, font_size, text_color, bg_color, position
 
     return img
 
-def download_images(images_with_text, text_idx, selected_sizes, font_size, image_sizes):
-    for idx, image in enumerate(images_with_text):
-        for selected_size_label in selected_sizes:
-            image_size = image_sizes[selected_size_label]
-            image = image.resize(image_size, Image.ANTIALIAS)
-            st.image(image, caption=f"Text {text_idx + 1} - Image {idx + 1} - Font Size {font_size}", use_column_width=False)
-
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            href = f'<a href="data:file/png;base64,{img_str}" download="text_image_{text_idx}_{selected_size_label}_font_size_{font_size}.png">Download Image {idx + 1}</a>'
-            st.markdown(href, unsafe_allow_html=True)
+def encode_sizes(image, selected_sizes, image_sizes):
+    # The merged image resized to each selected size in turn, as PNG
+    encoded = []
+    for selected_size_label in selected_sizes:
+        image = image.resize(image_sizes[selected_size_label], Image.LANCZOS)
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        encoded.append((selected_size_label, buffered.getvalue()))
+    return encoded
+
+def download_images(encoded, text_idx, idx, font_size, export):
+    for selected_size_label, data in encoded:
+        st.image(data, caption=f"Text {text_idx + 1} - Image {idx + 1} - Font Size {font_size}", use_column_width=False)
+        export.add(archive_path(selected_size_label, f"text_image_{text_idx}_font_size_{font_size}_{export.count + 1}.png"), data)
 
 def main():
     st.title("Image Text Overlay App")
@@ -110,23 +116,45 @@ def main():
         "center": ("center", "center"),
     }
 
+    # Fill each size exactly, cropped around the photo's subject, instead of fitting inside it
+    crop_to_size = st.checkbox("Smart crop to each size")
+
     if st.button("Merge and Download"):
         if uploaded_images:
-            for text_idx, text in enumerate(texts):
-                for font_size in font_sizes:
-                    for text_color in text_colors:
-                        for bg_color in bg_colors:
-                            for position in selected_positions:
-                                images_with_text = []
-                                for image in uploaded_images:
-                                    img = Image.open(image)
-                                    for selected_size_label in selected_image_sizes:
-                                        resized_img = img.copy()
-                                        resized_img.thumbnail(image_sizes[selected_size_label])
-                                        merged_img = merge_text_with_image(resized_img, text, font_size, text_color, bg_color, position, position_mapping)
-                                        images_with_text.append(merged_img)
-
-                                download_images(images_with_text, text_idx, selected_image_sizes, font_size, image_sizes)
+            with ZipExport() as export:
+                decode_size = largest_dimensions(image_sizes[size] for size in selected_image_sizes)
+                # One task per merged image, in archive order; idx numbers the images of one text/style/position
+                tasks = []
+                for text_idx, text in enumerate(texts):
+                    for font_size in font_sizes:
+                        for text_color in text_colors:
+                            for bg_color in bg_colors:
+                                for position in selected_positions:
+                                    idx = 0
+                                    for image in uploaded_images:
+                                        for selected_size_label in selected_image_sizes:
+                                            tasks.append((text_idx, idx, text, font_size, image, image_sizes[selected_size_label],
+                                                          text_color, bg_color, position))
+                                            idx += 1
+
+                def draw(task):
+                    _, _, text, font_size, image, image_size, text_color, bg_color, position = task
+                    resized_img = source_cache.get_thumbnail(image, image_size, decode_size=decode_size, crop=crop_to_size)
+                    return merge_text_with_image(resized_img, text, font_size, text_color, bg_color, position, position_mapping)
+
+                def encode(merged_img):
+                    return encode_sizes(merged_img, selected_image_sizes, image_sizes)
+
+                # Images are drawn, encoded and shown as a pipeline, so the first ones appear while the rest render
+                def publish(index, encoded):
+                    text_idx, idx, _, font_size = tasks[index][:4]
+                    download_images(encoded, text_idx, idx, font_size, export)
+
+                errors = pipeline_map(tasks, [("draw", draw), ("encode", encode)], publish)
+                for index, message in errors:
+                    st.error(f"Image {index + 1} failed: {message}")
+
+                st.download_button(f"Download all ({export.count} images)", data=export.finish(), file_name="text_images.zip", mime="application/zip")
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,11 @@
 import os
 import streamlit as st
-import base64
-from io import BytesIO
 from PIL import Image
+from editor_pages import background_url, select_page
+from image_cache import largest_dimensions, source_cache
+from layout_templates import editor_offsets
+from upload_ingest import ingest_images, ingest_logo
+from variant_planner import describe_plan, plan_variants, position_layouts
 
 # Main function to handle the Streamlit app logic
 def main():
@@ -11,21 +14,20 @@ def main():
     uploaded_images = st.file_uploader("Upload multiple images", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
     uploaded_logo = st.file_uploader("Upload logo image", type=["jpg", "jpeg", "png"])
 
-    logo_base64 = None
-    if uploaded_logo:
-        logo = Image.open(uploaded_logo)
-        buffered_logo = BytesIO()
-        logo.save(buffered_logo, format="PNG")
-        logo_base64 = base64.b64encode(buffered_logo.getvalue()).decode()
+    uploaded_images, image_previews, duplicate_names = ingest_images(uploaded_images)
+    logo_url, logo_png = ingest_logo(uploaded_logo)
+
+    if duplicate_names:
+        st.warning(f"Skipped duplicate uploads: {', '.join(duplicate_names)}")
 
     if uploaded_images:
         st.write("Images uploaded successfully!")
-        for uploaded_image in uploaded_images:
-            st.image(uploaded_image, caption="Uploaded Image", use_column_width=True)
+        for preview in image_previews:
+            st.image(preview, caption="Uploaded Image", use_column_width=True)
 
     if uploaded_logo:
         st.write("Logo uploaded successfully!")
-        st.image(uploaded_logo, caption="Uploaded Logo", use_column_width=True)
+        st.image(logo_png, caption="Uploaded Logo", use_column_width=True)
 
     num_pairs = st.number_input("Number of Call to Action + Description Pairs", min_value=1, step=1)
     call_to_action_texts = [st.text_input(f"Call to Action Text {i + 1}") for i in range(num_pairs)]
@@ -81,58 +83,75 @@ def main():
                 if st.checkbox(label, key=f"{channel}_{label}"):
                     selected_image_sizes.append((channel, label, dimensions))
 
-    if st.button("Merge and Download"):
-        if uploaded_images and selected_cta_positions and selected_desc_positions and selected_logo_positions:
+    # Only layouts where CTA, description and logo each get their own spot are rendered
+    layouts = position_layouts(selected_cta_positions, selected_desc_positions, selected_logo_positions)
+    plan = plan_variants(len(uploaded_images or []), len(call_to_action_texts), len(layouts),
+                         [dimensions for _, _, dimensions in selected_image_sizes])
+    st.caption(f"Planned: {describe_plan(plan)}")
+    for problem in plan['over_limits']:
+        st.error(f"Too many variants: {problem}. Select fewer positions, texts or sizes.")
+
+    # Cut each size to its own aspect ratio around the photo's subject instead of stretching it
+    crop_to_size = st.checkbox("Smart crop to each size")
+
+    if st.button("Merge and Download", disabled=bool(plan['over_limits'])):
+        if uploaded_images and layouts:
             st.write("Processing images...")
 
             images_data = []
+            # Every size is resized from one reduced decode that covers the largest of them
+            decode_size = largest_dimensions(dimensions for _, _, dimensions in selected_image_sizes)
             for image in uploaded_images:
                 for call_to_action_text, description_text in zip(call_to_action_texts, description_texts):
-                    for cta_position in selected_cta_positions:
-                        for desc_position in selected_desc_positions:
-                            for logo_position in selected_logo_positions:
-                                if cta_position != desc_position and cta_position != logo_position and desc_position != logo_position:
-                                    for channel, label, dimensions in selected_image_sizes:
-                                        img = Image.open(image)
-                                        img_resized = img.resize(dimensions, Image.ANTIALIAS)
-                                        buffered = BytesIO()
-                                        img_resized.save(buffered, format="PNG")
-                                        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-
-                                        images_data.append({
-                                            'img_base64': img_base64,
-                                            'call_to_action_text': call_to_action_text,
-                                            'description_text': description_text,
-                                            'logo_base64': logo_base64 if uploaded_logo else None,
-                                            'cta_bg_color': call_to_action_bg_color,
-                                            'cta_text_color': call_to_action_text_color,
-                                            'desc_bg_color': description_bg_color,
-                                            'desc_text_color': description_text_color,
-                                            'logo_transparency': logo_transparency
-                                        })
-
-            add_draggable_functionality(images_data, dimensions[0], dimensions[1])
+                    for cta_position, desc_position, logo_position in layouts:
+                        for channel, label, dimensions in selected_image_sizes:
+                            img_resized = source_cache.get_resized(image, dimensions, Image.LANCZOS, decode_size, crop=crop_to_size)
+
+                            images_data.append({
+                                'image': img_resized,
+                                'call_to_action_text': call_to_action_text,
+                                'description_text': description_text,
+                                'logo_url': logo_url,
+                                'cta_bg_color': call_to_action_bg_color,
+                                'cta_text_color': call_to_action_text_color,
+                                'desc_bg_color': description_bg_color,
+                                'desc_text_color': description_text_color,
+                                'logo_transparency': logo_transparency
+                            })
+
+            # Keep the variants so the editor can page through them on later reruns
+            st.session_state['images_data'] = images_data
+            st.session_state['editor_dimensions'] = dimensions
+
+    if st.session_state.get('images_data'):
+        editor_width, editor_height = st.session_state['editor_dimensions']
+        add_draggable_functionality(st.session_state['images_data'], editor_width, editor_height)
 
 def add_draggable_functionality(images_data, img_width, img_height):
     html_parts = []
     
-    # Iterate over each image and its associated data
-    for index, data in enumerate(images_data):
+    # Only the selected page of variants is turned into HTML
+    start, end = select_page(len(images_data))
+    for index in range(start, end):
+        data = images_data[index]
         cta_id = f"ctaText_{index}"
         desc_id = f"descText_{index}"
         logo_id = f"logoImage_{index}"
 
+        # Start from the default template's placements for this editor size
+        offsets = editor_offsets(data['call_to_action_text'], data['description_text'], (img_width, img_height), 5, 5)
+
         # Generate HTML for each image
         html_part = f"""
-            <div id="imageContainer_{index}" style="position: relative; width: {img_width}px; height: {img_height}px; background-image: url('data:image/png;base64,{data['img_base64']}'); background-size: contain; background-repeat: no-repeat;">
-                <div id="{cta_id}" class="draggable resizable" style="position: absolute; top: 50px; left: 50px; background-color:{data['cta_bg_color']}; color:{data['cta_text_color']}; padding: 5px; font-size: 16px; display: inline-block;">
+            <div id="imageContainer_{index}" style="position: relative; width: {img_width}px; height: {img_height}px; background-image: url('{background_url(data)}'); background-size: contain; background-repeat: no-repeat;">
+                <div id="{cta_id}" class="draggable resizable" style="position: absolute; top: {offsets['cta'][1]}px; left: {offsets['cta'][0]}px; background-color:{data['cta_bg_color']}; color:{data['cta_text_color']}; padding: 5px; font-size: 16px; display: inline-block;">
                     {data['call_to_action_text']}
                 </div>
-                <div id="{desc_id}" class="draggable resizable" style="position: absolute; top: 150px; left: 50px; background-color:{data['desc_bg_color']}; color:{data['desc_text_color']}; padding: 5px; font-size: 16px; display: inline-block;">
+                <div id="{desc_id}" class="draggable resizable" style="position: absolute; top: {offsets['desc'][1]}px; left: {offsets['desc'][0]}px; background-color:{data['desc_bg_color']}; color:{data['desc_text_color']}; padding: 5px; font-size: 16px; display: inline-block;">
                     {data['description_text']}
                 </div>
-                <div id="{logo_id}" class="draggable resizable" style="position: absolute; top: 250px; left: 50px; padding: 5px; display: inline-block; opacity: {data['logo_transparency']};">
-                    <img src="data:image/png;base64,{data['logo_base64']}" style="width: 100%; height: auto;">
+                <div id="{logo_id}" class="draggable resizable" style="position: absolute; top: {offsets['logo'][1]}px; left: {offsets['logo'][0]}px; width: {offsets['logo_width']}px; padding: 5px; display: inline-block; opacity: {data['logo_transparency']};">
+                    <img src="{data['logo_url']}" style="width: 100%; height: auto;">
                 </div>
             </div>
         """
@@ -237,7 +256,7 @@ def add_draggable_functionality(images_data, img_width, img_height):
 
             // Apply interactions to each element with unique IDs
     """
-    for index in range(len(images_data)):
+    for index in range(start, end):
         js_part += f"""
             applyInteractions('ctaText_{index}');
             applyInteractions('descText_{index}');
@@ -249,7 +268,7 @@ def add_draggable_functionality(images_data, img_width, img_height):
     """
 
     # Combine HTML and JS into the final component
-    st.components.v1.html(html_content + js_part, height=img_height * len(images_data) + 300)
+    st.components.v1.html(html_content + js_part, height=img_height * (end - start) + 300)
 
 if __name__ == "__main__":
     main()
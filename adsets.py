@@ -1,8 +1,19 @@
 import os
 import streamlit as st
-import base64
-from io import BytesIO
 from PIL import Image
+from editor_component import layout_editor, reset_layouts
+from editor_pages import background_url, select_page
+from encoders import encode_for_size
+from image_cache import largest_dimensions, source_cache
+from layout_templates import editor_offsets
+from logo_assets import get_logo_asset
+from preview_gallery import PreviewGallery
+from render_engine import render_creative, render_from_layout
+from render_memo import variant_key
+from render_pipeline import pipeline_map
+from upload_ingest import ingest_images, ingest_logo
+from variant_planner import describe_plan, plan_variants
+from zip_export import ZipExport
 
 # Main function to handle the Streamlit app logic
 def main():
@@ -11,21 +22,20 @@ def main():
     uploaded_images = st.file_uploader("Upload multiple images", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
     uploaded_logo = st.file_uploader("Upload logo image", type=["jpg", "jpeg", "png"])
 
-    logo_base64 = None
-    if uploaded_logo:
-        logo = Image.open(uploaded_logo)
-        buffered_logo = BytesIO()
-        logo.save(buffered_logo, format="PNG")
-        logo_base64 = base64.b64encode(buffered_logo.getvalue()).decode()
+    uploaded_images, image_previews, duplicate_names = ingest_images(uploaded_images)
+    logo_url, logo_png = ingest_logo(uploaded_logo)
+
+    if duplicate_names:
+        st.warning(f"Skipped duplicate uploads: {', '.join(duplicate_names)}")
 
     if uploaded_images:
         st.write("Images uploaded successfully!")
-        for uploaded_image in uploaded_images:
-            st.image(uploaded_image, caption="Uploaded Image", use_column_width=True)
+        for preview in image_previews:
+            st.image(preview, caption="Uploaded Image", use_column_width=True)
 
     if uploaded_logo:
         st.write("Logo uploaded successfully!")
-        st.image(uploaded_logo, caption="Uploaded Logo", use_column_width=True)
+        st.image(logo_png, caption="Uploaded Logo", use_column_width=True)
 
     num_pairs = st.number_input("Number of Call to Action + Description Pairs", min_value=1, step=1)
     call_to_action_texts = [st.text_input(f"Call to Action Text {i + 1}") for i in range(num_pairs)]
@@ -73,65 +83,89 @@ def main():
                 if st.checkbox(label, key=f"{channel}_{label}"):
                     selected_image_sizes.append((channel, label, dimensions))
 
-    if st.button("Merge and Download"):
+    # Cut each size to its own aspect ratio around the photo's subject instead of stretching it
+    crop_to_size = st.checkbox("Smart crop to each size")
+
+    # One default placement per creative; mixing crosses every CTA with every description
+    num_text_pairs = len(call_to_action_texts) * (len(description_texts) if mix_cta_desc == "Yes" else 1)
+    plan = plan_variants(len(uploaded_images or []), num_text_pairs, 1,
+                         [dimensions for _, _, dimensions in selected_image_sizes])
+    st.caption(f"Planned: {describe_plan(plan)}")
+    for problem in plan['over_limits']:
+        st.error(f"Too many variants: {problem}. Select fewer texts or sizes.")
+
+    if st.button("Merge and Download", disabled=bool(plan['over_limits'])):
         if uploaded_images:
             st.write("Processing images...")
 
             images_data = []
+            # Every size is resized from one reduced decode that covers the largest of them
+            decode_size = largest_dimensions(dimensions for _, _, dimensions in selected_image_sizes)
+            # Lets the final render spot variants that come out identical
+            source_digests = [source_cache.source_key(image) for image in uploaded_images]
 
             if mix_cta_desc == "Yes":
                 # Produce all combinations of CTA and Description
                 for call_to_action_text in call_to_action_texts:
                     for description_text in description_texts:
-                        for image in uploaded_images:
+                        for image, source_digest in zip(uploaded_images, source_digests):
                             for channel, label, dimensions in selected_image_sizes:
-                                img = Image.open(image)
-                                img_resized = img.resize(dimensions, Image.LANCZOS)
-                                buffered = BytesIO()
-                                img_resized.save(buffered, format="PNG")
-                                img_base64 = base64.b64encode(buffered.getvalue()).decode()
+                                img_resized = source_cache.get_resized(image, dimensions, Image.LANCZOS, decode_size, crop=crop_to_size)
 
                                 images_data.append({
-                                    'img_base64': img_base64,
+                                    'image': img_resized,
+                                    'source_digest': source_digest,
                                     'call_to_action_text': call_to_action_text,
                                     'description_text': description_text,
-                                    'logo_base64': logo_base64 if uploaded_logo else None,
+                                    'logo_url': logo_url,
                                     'cta_bg_color': call_to_action_bg_color,
                                     'cta_text_color': call_to_action_text_color,
                                     'desc_bg_color': description_bg_color,
                                     'desc_text_color': description_text_color,
-                                    'text_shape': text_shape
+                                    'text_shape': text_shape,
+                                    'channel': channel,
+                                    'label': label,
+                                    'dimensions': dimensions
                                 })
             else:
                 # Produce images without mixing CTAs and Descriptions
                 for call_to_action_text, description_text in zip(call_to_action_texts, description_texts):
-                    for image in uploaded_images:
+                    for image, source_digest in zip(uploaded_images, source_digests):
                         for channel, label, dimensions in selected_image_sizes:
-                            img = Image.open(image)
-                            img_resized = img.resize(dimensions, Image.LANCZOS)
-                            buffered = BytesIO()
-                            img_resized.save(buffered, format="PNG")
-                            img_base64 = base64.b64encode(buffered.getvalue()).decode()
+                            img_resized = source_cache.get_resized(image, dimensions, Image.LANCZOS, decode_size, crop=crop_to_size)
 
                             images_data.append({
-                                'img_base64': img_base64,
+                                'image': img_resized,
+                                'source_digest': source_digest,
                                 'call_to_action_text': call_to_action_text,
                                 'description_text': description_text,
-                                'logo_base64': logo_base64 if uploaded_logo else None,
+                                'logo_url': logo_url,
                                 'cta_bg_color': call_to_action_bg_color,
                                 'cta_text_color': call_to_action_text_color,
                                 'desc_bg_color': description_bg_color,
                                 'desc_text_color': description_text_color,
-                                'text_shape': text_shape
+                                'text_shape': text_shape,
+                                'channel': channel,
+                                'label': label,
+                                'dimensions': dimensions
                             })
 
-            add_draggable_functionality(images_data, dimensions[0], dimensions[1])
+            # Keep the variants so the editor can page through them on later reruns
+            st.session_state['images_data'] = images_data
+            reset_layouts()
+            st.session_state['editor_dimensions'] = dimensions
+
+    if st.session_state.get('images_data'):
+        editor_width, editor_height = st.session_state['editor_dimensions']
+        add_draggable_functionality(st.session_state['images_data'], editor_width, editor_height, uploaded_logo)
 
-def add_draggable_functionality(images_data, img_width, img_height):
+def add_draggable_functionality(images_data, img_width, img_height, uploaded_logo=None):
     html_parts = []
 
-    # Iterate over each image and its associated data
-    for index, data in enumerate(images_data):
+    # Only the selected page of variants is turned into HTML
+    start, end = select_page(len(images_data))
+    for index in range(start, end):
+        data = images_data[index]
         cta_id = f"ctaText_{index}"
         desc_id = f"descText_{index}"
         logo_id = f"logoImage_{index}"
@@ -142,17 +176,20 @@ def add_draggable_functionality(images_data, img_width, img_height):
         else:
             border_radius = "0px"  # Rectangle
 
+        # Start from the default template's placements for this editor size
+        offsets = editor_offsets(data['call_to_action_text'], data['description_text'], (img_width, img_height), 12, 20)
+
         # Generate HTML for each image
         html_part = f"""
-            <div id="imageContainer_{index}" style="position: relative; width: {img_width}px; height: {img_height}px; background-image: url('data:image/png;base64,{data['img_base64']}'); background-size: contain; background-repeat: no-repeat;">
-                <div id="{cta_id}" class="draggable resizable" style="position: absolute; top: 50px; left: 50px; background-color:{data['cta_bg_color']}; color:{data['cta_text_color']}; padding: 10px; font-size: 16px; display: inline-block; border-radius: {border_radius}; border: 2px solid {data['cta_bg_color']};">
+            <div id="imageContainer_{index}" style="position: relative; width: {img_width}px; height: {img_height}px; background-image: url('{background_url(data)}'); background-size: contain; background-repeat: no-repeat;">
+                <div id="{cta_id}" class="draggable resizable" style="position: absolute; top: {offsets['cta'][1]}px; left: {offsets['cta'][0]}px; background-color:{data['cta_bg_color']}; color:{data['cta_text_color']}; padding: 10px; font-size: 16px; display: inline-block; border-radius: {border_radius}; border: 2px solid {data['cta_bg_color']};">
                     {data['call_to_action_text']}
                 </div>
-                <div id="{desc_id}" class="draggable resizable" style="position: absolute; top: 150px; left: 50px; background-color:{data['desc_bg_color']}; color:{data['desc_text_color']}; padding: 10px; font-size: 16px; display: inline-block; border-radius: {border_radius}; border: 2px solid {data['desc_bg_color']};">
+                <div id="{desc_id}" class="draggable resizable" style="position: absolute; top: {offsets['desc'][1]}px; left: {offsets['desc'][0]}px; background-color:{data['desc_bg_color']}; color:{data['desc_text_color']}; padding: 10px; font-size: 16px; display: inline-block; border-radius: {border_radius}; border: 2px solid {data['desc_bg_color']};">
                     {data['description_text']}
                 </div>
-                <div id="{logo_id}" class="draggable resizable logo-grabbable" style="position: absolute; top: 250px; left: 50px; padding: 20px; cursor: move; display: inline-block; opacity: 1;">
-                    <img src="data:image/png;base64,{data['logo_base64']}" style="width: 100%; height: auto; pointer-events: none;">
+                <div id="{logo_id}" class="draggable resizable logo-grabbable" style="position: absolute; top: {offsets['logo'][1]}px; left: {offsets['logo'][0]}px; width: {offsets['logo_width']}px; padding: 20px; cursor: move; display: inline-block; opacity: 1;">
+                    <img src="{data['logo_url']}" style="width: 100%; height: auto; pointer-events: none;">
                 </div>
             </div>
             <div style="margin-top: 10px;">
@@ -166,122 +203,65 @@ def add_draggable_functionality(images_data, img_width, img_height):
     # Combine all HTML parts into a single string
     html_content = "\n".join(html_parts)
 
-    # Generate JavaScript for each image
-    js_part = """
-        <script src="https://cdn.jsdelivr.net/npm/interactjs@1.10.11/dist/interact.min.js"></script>
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/html2canvas/0.4.1/html2canvas.min.js"></script>
-        <script>
-            function applyInteractions(elementId) {
-                interact('#' + elementId).draggable({
-                    inertia: true,
-                    modifiers: [
-                        interact.modifiers.restrictRect({
-                            restriction: 'parent',
-                            endOnly: true
-                        })
-                    ],
-                    autoScroll: true,
-                    onmove: dragMoveListener
-                }).resizable({
-                    edges: { left: true, right: true, bottom: true, top: true },
-                    inertia: true,
-                    modifiers: [
-                        interact.modifiers.restrictEdges({
-                            outer: 'parent'
-                        }),
-                        interact.modifiers.restrictSize({
-                            min: { width: 50, height: 20 }
-                        })
-                    ],
-                    onmove: resizeMoveListener
-                });
-            }
-
-            function adjustOpacity(elementId, value) {
-                document.getElementById(elementId).style.opacity = value / 100;
-            }
-
-            function dragMoveListener(event) {
-                var target = event.target,
-                    x = (parseFloat(target.getAttribute('data-x')) || 0) + event.dx,
-                    y = (parseFloat(target.getAttribute('data-y')) || 0) + event.dy;
-
-                target.style.transform = 'translate(' + x + 'px, ' + y + 'px)';
-
-                target.setAttribute('data-x', x);
-                target.setAttribute('data-y', y);
-            }
-
-            function resizeMoveListener(event) {
-                var target = event.target,
-                    x = (parseFloat(target.getAttribute('data-x')) || 0),
-                    y = (parseFloat(target.getAttribute('data-y')) || 0);
-
-                // Ensure the background fits tightly around the text with padding
-                target.style.width = 'auto';
-                target.style.height = 'auto';
-                target.style.whiteSpace = 'nowrap';
-
-                // Calculate and set the new font size based on the container size
-                let newFontSize = Math.min(event.rect.width, event.rect.height) / 5;
-                target.style.fontSize = newFontSize + 'px';
-
-                // Keep the padding consistent around the text and logo
-                target.style.padding = '10px';
-
-                x += event.deltaRect.left;
-                y += event.deltaRect.top;
-
-                target.style.transform = 'translate(' + x + 'px,' + y + 'px)';
-
-                target.setAttribute('data-x', x);
-                target.setAttribute('data-y', y);
-
-                // Adjust the logo resizing
-                if (target.id.includes('logoImage')) {
-                    let img = target.querySelector('img');
-                    img.style.width = event.rect.width + 'px';
-                    img.style.height = event.rect.height + 'px';
-                }
-            }
-
-            function saveImage() {
-                console.log("Merge and Download button clicked");
-                var images = document.querySelectorAll("[id^='imageContainer_']");
-                images.forEach(function(imageContainer, index) {
-                    html2canvas(imageContainer).then(function(canvas) {
-                        console.log("Canvas generated for image " + index + ", preparing download...");
-                        var dataURL = canvas.toDataURL('image/png');
-                        var link = document.createElement('a');
-                        link.href = dataURL;
-                        link.download = 'final_image_' + index + '.png';
-                        console.log("Triggering download for image " + index + "...");
-                        link.click();
-                        console.log("Download triggered for image " + index + ".");
-                    }).catch(function(error) {
-                        console.error("Error capturing the image " + index + ": ", error);
-                    });
-                });
-            }
-
-            // Apply interactions to each element with unique IDs
-    """
-    for index in range(len(images_data)):
-        js_part += f"""
-            applyInteractions('ctaText_{index}');
-            applyInteractions('descText_{index}');
-            applyInteractions('logoImage_{index}');
-            adjustOpacity('ctaText_{index}', 100);
-            adjustOpacity('descText_{index}', 100);
-            adjustOpacity('logoImage_{index}', 100);
-        """
-
-    js_part += """
-        </script>
-    """
-
-    # Combine HTML and JS into the final component
-    st.components.v1.html(html_content + js_part, height=img_height * len(images_data) + 300)
+    # The editor posts the arranged layout back; final creatives are rendered with Pillow
+    layouts = layout_editor(html_content, range(start, end))
+    st.caption(f"{len(layouts)} of {len(images_data)} creatives arranged; the rest use the default placement")
+    if st.button("Render final creatives"):
+        render_final_creatives(images_data, layouts, uploaded_logo)
+
+def render_key(index, data, layouts):
+    # Arranged creatives are drawn as laid out; the rest share a render with
+    # every variant that differs only in channel (or repeats a text pair)
+    if index in layouts:
+        return ('layout', index)
+    inputs = {key: value for key, value in data.items() if key not in ('image', 'source_digest')}
+    return variant_key(inputs, data['source_digest'], None)
+
+def render_final_creatives(images_data, layouts, uploaded_logo):
+    logo_asset = get_logo_asset(uploaded_logo) if uploaded_logo else None
+    progress_bar = st.progress(0.0, text="Rendering creatives...")
+    gallery = PreviewGallery(len(images_data))
+
+    # Indices of the variants each distinct render is filed under, in order
+    groups = {}
+    for index, data in enumerate(images_data):
+        groups.setdefault(render_key(index, data, layouts), []).append(index)
+    groups = list(groups.values())
+
+    def draw(index):
+        data = images_data[index]
+        if index in layouts:
+            return index, render_from_layout(data['image'], data, layouts[index], logo_asset)
+        return index, render_creative(data['image'], data, logo_asset)
+
+    def encode(drawn):
+        index, final_image = drawn
+        return encode_for_size(final_image, images_data[index]['label'])
+
+    def report_progress(done, total):
+        progress_bar.progress(done / total, text=f"Rendered {done} of {total} creatives")
+
+    with ZipExport() as export:
+        # Drawing, encoding and publishing overlap; finished creatives show up in the gallery as they arrive
+        def publish(position, encoded):
+            for index in groups[position]:
+                data = images_data[index]
+                filename = f"final_image_{index}.{encoded['extension']}"
+                export.add_variant(data['channel'], data['label'], filename, encoded['data'])
+                gallery.show(encoded['data'], caption=f"{data['channel']} {data['label']}")
+
+        errors = pipeline_map([group[0] for group in groups], [("draw", draw), ("encode", encode)], publish,
+                              progress=report_progress)
+        for position, message in errors:
+            for index in groups[position]:
+                st.error(f"final_image_{index} failed: {message}")
+
+        st.download_button(
+            f"Download all ({export.count} creatives)",
+            data=export.finish(),
+            file_name="creatives.zip",
+            mime="application/zip",
+        )
 
 if __name__ == "__main__":
     main()
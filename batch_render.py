@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import sys
+
+from encoders import OUTPUT_FORMATS
+from instrumentation import start_job
+from parallel_render import default_workers
+from render_engine import render_campaign
+
+# Command-line entry point for rendering a whole campaign without Streamlit.
+#
+# Example spec (paths are relative to the spec file):
+# {
+#     "images": ["photos/beach.jpg", "photos/city.jpg"],
+#     "logo": "logo.png",
+#     "call_to_action_texts": ["Apply Now", "Learn More"],
+#     "description_texts": ["Fall classes start soon", "Small classes, big futures"],
+#     "mix_cta_desc": true,
+#     "colors": {"cta_text": "#FFFFFF", "cta_bg": "#000000", "desc_text": "#FFFFFF", "desc_bg": "#000000"},
+#     "text_shape": "Pill-shaped",
+#     "smart_crop": true,
+#     "sizes": ["Spotify", ["YouTube", "1280x720"]],
+#     "output_format": "Auto",
+#     "encoding_profiles": {"300x250": {"format": "JPEG", "max_kb": 150}}
+# }
+
+
+def load_campaign(spec_path):
+    with open(spec_path) as spec_file:
+        campaign = json.load(spec_file)
+
+    base_dir = os.path.dirname(os.path.abspath(spec_path))
+    campaign['images'] = [os.path.join(base_dir, path) for path in campaign['images']]
+    if campaign.get('logo'):
+        campaign['logo'] = os.path.join(base_dir, campaign['logo'])
+    return campaign
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render every ad variant of a campaign spec to disk.")
+    parser.add_argument("spec", help="Path to the campaign spec JSON file")
+    parser.add_argument("-o", "--output-dir", default="output", help="Directory to write creatives into")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default=None,
+                        help="Output format; Auto picks per ad size with a file-size budget (default: Auto)")
+    parser.add_argument("-j", "--workers", type=int, default=default_workers(),
+                        help="Number of render processes (default: one per CPU)")
+    parser.add_argument("--metrics", default=None,
+                        help="Write per-stage timings and peak memory here (.prom for Prometheus text, else JSON)")
+    args = parser.parse_args(argv)
+
+    campaign = load_campaign(args.spec)
+    if args.format:
+        campaign['output_format'] = args.format
+    if args.metrics:
+        job_metrics = start_job(os.path.basename(args.spec))
+    written, errors = render_campaign(campaign, args.output_dir, workers=args.workers)
+    if args.metrics:
+        job_metrics.finish()
+        with open(args.metrics, "w") as metrics_file:
+            metrics_file.write(job_metrics.to_prometheus() if args.metrics.endswith(".prom") else job_metrics.to_json())
+    for index, message in errors:
+        print(f"Variant {index} failed: {message}", file=sys.stderr)
+
+    with open(os.path.join(args.output_dir, "manifest.json")) as manifest_file:
+        over_budget = [entry for entry in json.load(manifest_file) if not entry['within_budget']]
+    for entry in over_budget:
+        print(f"{entry['path']} is {entry['bytes'] // 1024} KB, over its {entry['budget_bytes'] // 1024} KB budget", file=sys.stderr)
+    print(f"Wrote {len(written)} creatives to {args.output_dir}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+import argparse
+import base64
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import PIL
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoders import encode_image
+from font_registry import DEFAULT_FONT_PATH, get_font
+from image_cache import SourceCache, source_cache
+from logo_assets import LogoAsset, clear_logo_assets
+from render_engine import draw_text_box, render_campaign, render_creative
+from sprite_cache import sprite_cache
+from text_fit import fit_font_size
+
+# Micro-benchmarks for the rendering hot paths.
+#
+# Every stage runs on synthetic fixtures (a noisy gradient "photo" as JPEG and
+# PNG, an RGBA logo) and the bundled arial.ttf, across the distinct ad sizes
+# and a few variant counts. Results are written as JSON together with the
+# commit they were measured on; pass --compare with an earlier results file to
+# see the change per stage. The resize_pyramid stage also records its PSNR
+# against a direct LANCZOS resize (psnr_db; 99 means identical), so a speed
+# change in the resize path shows what it cost in quality. render_creative
+# and render_campaign start every run with the process-wide caches (decoded
+# sources, text sprites, logo assets) empty; render_campaign is measured again
+# with them warm from the previous run, as a second session rendering the same
+# campaign would find them.
+#
+#   python benchmarks/bench_render.py -o bench.json
+#   python benchmarks/bench_render.py -o bench-new.json --compare bench.json
+#
+# The app-level stages (OLDads5.calculate_font_size and overlay_logo, editor
+# HTML generation) import Streamlit and are skipped when it is not installed.
+
+AD_SIZES = [(300, 250), (728, 90), (640, 640), (1280, 720)]
+VARIANT_COUNTS = [1, 10, 50]
+SOURCE_SIZE = (3000, 2000)
+LOGO_FIXTURE_SIZE = (400, 400)
+CTA_TEXT = "Apply Now"
+DESC_TEXT = "Small classes, big futures"
+
+
+def make_fixtures(directory):
+    # Gradient plus noise so the encoders see photo-like entropy
+    gradient = Image.linear_gradient("L").resize(SOURCE_SIZE)
+    noise = Image.effect_noise(SOURCE_SIZE, 40)
+    photo = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    fixtures = {
+        'jpeg': os.path.join(directory, "photo.jpg"),
+        'png': os.path.join(directory, "photo.png"),
+        'logo': os.path.join(directory, "logo.png"),
+    }
+    photo.save(fixtures['jpeg'], quality=90)
+    photo.save(fixtures['png'])
+
+    logo = Image.new("RGBA", LOGO_FIXTURE_SIZE, (0, 0, 0, 0))
+    ImageDraw.Draw(logo).ellipse([(20, 20), (380, 380)], fill=(200, 30, 30, 255), outline=(255, 255, 255, 255), width=12)
+    logo.save(fixtures['logo'])
+    return fixtures
+
+
+def measure(func, repeat, setup=None):
+    # func(state) is timed; setup() builds its state outside the timed region
+    timings = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        func(state)
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min_ms': min(timings) * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.mean(timings) * 1000,
+    }
+
+
+def cold_caches():
+    # Empties the process-wide caches the render paths fill as they go
+    source_cache.clear()
+    sprite_cache.clear()
+    clear_logo_assets()
+
+
+def size_label(dimensions):
+    return f"{dimensions[0]}x{dimensions[1]}"
+
+
+def psnr(image, reference):
+    stat = ImageStat.Stat(ImageChops.difference(image.convert("RGB"), reference.convert("RGB")))
+    mse = sum(stat.sum2) / (reference.width * reference.height * len(stat.sum2))
+    return 99.0 if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def bench_library(fixtures, repeat):
+    results = []
+
+    def record(stage, params, timing):
+        results.append(dict(stage=stage, params=params, **timing))
+
+    for kind in ('jpeg', 'png'):
+        record("decode", {'format': kind},
+               measure(lambda cache: cache.get_source(fixtures[kind]), repeat, SourceCache))
+        for dimensions in AD_SIZES:
+            record("decode_reduced", {'format': kind, 'size': size_label(dimensions)},
+                   measure(lambda cache: cache.get_source(fixtures[kind], dimensions), repeat, SourceCache))
+
+    source = SourceCache().get_source(fixtures['jpeg'])
+    for dimensions in AD_SIZES:
+        record("resize", {'size': size_label(dimensions)},
+               measure(lambda _: source.resize(dimensions, Image.LANCZOS), repeat))
+
+    def source_loaded():
+        cache = SourceCache()
+        cache.get_source(fixtures['jpeg'], source.size)
+        return cache
+
+    # Pyramid levels are built inside the timed run, as for the first size of a photo
+    for dimensions in AD_SIZES:
+        timing = measure(lambda cache: cache.get_resized(fixtures['jpeg'], dimensions, Image.LANCZOS, source.size),
+                         repeat, source_loaded)
+        resized = source_loaded().get_resized(fixtures['jpeg'], dimensions, Image.LANCZOS, source.size)
+        timing['psnr_db'] = round(psnr(resized, source.resize(dimensions, Image.LANCZOS)), 2)
+        record("resize_pyramid", {'size': size_label(dimensions)}, timing)
+    record("resize_all_sizes", {'path': "direct"},
+           measure(lambda _: [source.resize(dimensions, Image.LANCZOS) for dimensions in AD_SIZES], repeat))
+    record("resize_all_sizes", {'path': "pyramid"},
+           measure(lambda cache: [cache.get_resized(fixtures['jpeg'], dimensions, Image.LANCZOS, source.size)
+                                  for dimensions in AD_SIZES], repeat, source_loaded))
+
+    # A new text per run so the metrics memo does not hide the search
+    counter = iter(range(10 ** 9))
+    for dimensions in AD_SIZES:
+        box = (dimensions[0] // 2, dimensions[1] // 10)
+        record("font_fit", {'size': size_label(dimensions)},
+               measure(lambda _: fit_font_size(f"{DESC_TEXT} {next(counter)}", box[0], box[1]), repeat))
+
+    for font_size in (20, 48):
+        font = get_font(font_size, DEFAULT_FONT_PATH)
+        for text_shape in ("Rectangle", "Pill-shaped"):
+            canvas = Image.new("RGBA", (1280, 720))
+            record("text_draw", {'font_size': font_size, 'shape': text_shape},
+                   measure(lambda _: draw_text_box(ImageDraw.Draw(canvas), DESC_TEXT, (50, 50), font,
+                                                   "#FFFFFF", "#000000", text_shape), repeat))
+
+    with Image.open(fixtures['logo']) as logo_image:
+        logo_image.load()
+    for dimensions in AD_SIZES:
+        base = source.resize(dimensions, Image.LANCZOS)
+        box = (max(1, dimensions[0] // 5), max(1, dimensions[1] // 5))
+
+        def composite(asset):
+            img = base.convert("RGBA")
+            logo = asset.scaled(box)
+            img.paste(logo, (0, 0), logo)
+            return img.convert("RGB")
+
+        record("logo_overlay", {'size': size_label(dimensions)},
+               measure(composite, repeat, lambda: LogoAsset(logo_image)))
+
+    font = get_font(20, DEFAULT_FONT_PATH)
+    variant = {'call_to_action_text': CTA_TEXT, 'description_text': DESC_TEXT,
+               'cta_text_color': "#FFFFFF", 'cta_bg_color': "#000000",
+               'desc_text_color': "#FFFFFF", 'desc_bg_color': "#000000", 'text_shape': "Rectangle"}
+    for dimensions in AD_SIZES:
+        base = source.resize(dimensions, Image.LANCZOS)
+        record("render_creative", {'size': size_label(dimensions)},
+               measure(lambda asset: render_creative(base, variant, asset, font), repeat,
+                       lambda: (cold_caches(), LogoAsset(logo_image))[1]))
+
+        rendered = render_creative(base, variant, LogoAsset(logo_image), font)
+        png = encode_image(rendered, "PNG")['data']
+        record("png_encode", {'size': size_label(dimensions)},
+               measure(lambda _: encode_image(rendered, "PNG"), repeat))
+        record("jpeg_budget_encode", {'size': size_label(dimensions)},
+               measure(lambda _: encode_image(rendered, "JPEG", max_kb=150), repeat))
+        record("base64_encode", {'size': size_label(dimensions), 'bytes': len(png)},
+               measure(lambda _: base64.b64encode(png).decode(), repeat))
+
+    for count in VARIANT_COUNTS:
+        # count distinct CTA texts at 300x250 so deduplication does not collapse them
+        campaign = {
+            'images': [fixtures['jpeg']],
+            'logo': fixtures['logo'],
+            'call_to_action_texts': [f"{CTA_TEXT} {index}" for index in range(count)],
+            'description_texts': [DESC_TEXT] * count,
+            'sizes': [["IP Targeting", "300x250"]],
+        }
+        with tempfile.TemporaryDirectory() as output_dir:
+            record("render_campaign", {'variants': count, 'caches': "cold"},
+                   measure(lambda _: render_campaign(campaign, output_dir), repeat, cold_caches))
+            # The last cold run leaves the caches filled
+            record("render_campaign", {'variants': count, 'caches': "warm"},
+                   measure(lambda _: render_campaign(campaign, output_dir), repeat))
+    return results
+
+
+def bench_app(fixtures, repeat):
+    # Stages that live in the Streamlit apps; run in Streamlit's bare mode
+    try:
+        import OLDads5
+        import ads5
+    except ImportError as error:
+        return [{'stage': "app", 'skipped': f"Streamlit apps not importable: {error}"}]
+
+    results = []
+    source = SourceCache().get_source(fixtures['jpeg'])
+    counter = iter(range(10 ** 9))
+    for dimensions in AD_SIZES:
+        base = source.resize(dimensions, Image.LANCZOS)
+        draw = ImageDraw.Draw(base.copy())
+        timing = measure(lambda _: OLDads5.calculate_font_size(draw, f"{DESC_TEXT} {next(counter)}",
+                                                                dimensions[0], dimensions[1], 0.5, 0.1), repeat)
+        results.append(dict(stage="calculate_font_size", params={'size': size_label(dimensions)}, **timing))
+
+        with open(fixtures['logo'], "rb") as logo_file:
+            logo = BytesIO(logo_file.read())
+        timing = measure(lambda _: OLDads5.overlay_logo(base, logo, "top-left", dimensions[0], dimensions[1], 0.2, 0.2), repeat)
+        results.append(dict(stage="overlay_logo", params={'size': size_label(dimensions)}, **timing))
+
+    base = source.resize((300, 250), Image.LANCZOS)
+    for count in VARIANT_COUNTS:
+        images_data = [{
+            'image': base, 'call_to_action_text': f"{CTA_TEXT} {index}", 'description_text': DESC_TEXT,
+            'logo_url': None, 'cta_bg_color': "#000000", 'cta_text_color': "#FFFFFF",
+            'desc_bg_color': "#000000", 'desc_text_color': "#FFFFFF", 'logo_transparency': 1.0,
+        } for index in range(count)]
+        timing = measure(lambda _: ads5.add_draggable_functionality(images_data, 300, 250), repeat)
+        results.append(dict(stage="editor_html", params={'variants': count}, **timing))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result['stage'], json.dumps(result.get('params', {}), sort_keys=True)
+
+
+def compare(results, baseline):
+    previous = {result_key(result): result for result in baseline['results'] if 'median_ms' in result}
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None or 'median_ms' not in result:
+            continue
+        change = (result['median_ms'] / before['median_ms'] - 1) * 100 if before['median_ms'] else 0.0
+        print(f"{result['stage']:<20} {result_key(result)[1]:<40} "
+              f"{before['median_ms']:9.2f} -> {result['median_ms']:9.2f} ms ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the creative rendering stages.")
+    parser.add_argument("-o", "--output", default="bench.json", help="Where to write the JSON results")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Timed runs per stage (default: 5)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    # Editor HTML embeds data URIs, as it would with the media server disabled
+    os.environ.setdefault("ADCREATIVE_MEDIA_SERVER", "0")
+    with tempfile.TemporaryDirectory() as fixture_dir:
+        fixtures = make_fixtures(fixture_dir)
+        results = bench_library(fixtures, args.repeat) + bench_app(fixtures, args.repeat)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
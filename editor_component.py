@@ -0,0 +1,33 @@
+import os
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+# Bidirectional variant editor.
+#
+# Unlike st.components.v1.html, a declared component can send a value back to
+# Python: the editor posts the rectangle, opacity and font size of every
+# element it shows, and the app renders the final creatives from that layout
+# with Pillow (render_engine.render_from_layout) instead of capturing the
+# browser's DOM with html2canvas. The frontend is a single static page in
+# editor_frontend/.
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "editor_frontend")
+_editor = components.declare_component("creative_editor", path=_FRONTEND_DIR)
+
+
+def layout_editor(html, indexes, key="layout_editor"):
+    # Shows the editor for the variants in indexes and returns every layout
+    # posted so far in this session, keyed by variant index
+    layouts = st.session_state.setdefault(f"{key}_layouts", {})
+    value = _editor(html=html, indexes=list(indexes), key=key, default=None)
+    if value and value.get('sent') != st.session_state.get(f"{key}_sent"):
+        st.session_state[f"{key}_sent"] = value['sent']
+        layouts.update({int(index): layout for index, layout in value['layouts'].items()})
+    return layouts
+
+
+def reset_layouts(key="layout_editor"):
+    # A new batch of variants starts from the default placements again
+    st.session_state.pop(f"{key}_layouts", None)
+    st.session_state.pop(f"{key}_sent", None)
@@ -0,0 +1,54 @@
+import math
+import weakref
+from io import BytesIO
+
+import streamlit as st
+
+from media_store import media_url, url_servable
+
+# Pagination for the draggable variant editor.
+#
+# The editor iframe only holds one page of variants; the rest stay as Pillow
+# images in session state and are encoded (and published to the media store)
+# when their page is opened.
+
+DEFAULT_PAGE_SIZE = 12
+
+# Variants built from the same source and size share one resized image, so the
+# background URL is memoized per image object (Pillow images are not hashable,
+# so key by id and drop the entry when the image is collected). The media
+# store evicts old blobs, so a memoized URL is only reused while it still
+# resolves.
+_background_urls = {}
+
+
+def select_page(total, page_size=DEFAULT_PAGE_SIZE, key="editor_page"):
+    # Returns the [start, end) slice of variants on the selected page
+    num_pages = max(1, math.ceil(total / page_size))
+
+    # A new batch of variants starts again from the first page
+    if st.session_state.get(f"{key}_total") != total:
+        st.session_state.pop(key, None)
+        st.session_state[f"{key}_total"] = total
+
+    if num_pages == 1:
+        return 0, total
+
+    page = st.number_input(f"Editor page (1-{num_pages}, {page_size} variants per page)",
+                           min_value=1, max_value=num_pages, value=1, step=1, key=key)
+    start = (page - 1) * page_size
+    st.caption(f"Showing variants {start + 1}-{min(start + page_size, total)} of {total}")
+    return start, min(start + page_size, total)
+
+
+def background_url(data):
+    # Encodes the variant's background the first time its page is shown
+    image = data['image']
+    url = _background_urls.get(id(image))
+    if url is None or not url_servable(url):
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        if id(image) not in _background_urls:
+            weakref.finalize(image, _background_urls.pop, id(image), None)
+        url = _background_urls[id(image)] = media_url(buffered.getvalue(), "image/png")
+    return url
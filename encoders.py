@@ -0,0 +1,126 @@
+from io import BytesIO
+from PIL import Image, features
+
+# Size-budgeted output encoding.
+#
+# Each ad size gets an encoding profile: the format to write and, for lossy
+# formats, a file-size budget. The JPEG/WebP quality is binary-searched to the
+# highest setting that still fits the budget, and the achieved size is
+# reported alongside the data so over-budget creatives can be flagged before
+# they are rejected by an ad network.
+
+MIN_QUALITY = 30
+MAX_QUALITY = 95
+
+# Budgets follow the common display-network 150 KB cap; larger formats get more room
+ENCODING_PROFILES = {
+    "300x250": {'format': "JPEG", 'max_kb': 150},
+    "728x90": {'format': "JPEG", 'max_kb': 150},
+    "640x640": {'format': "JPEG", 'max_kb': 200},
+    "1280x720": {'format': "JPEG", 'max_kb': 300},
+}
+DEFAULT_PROFILE = {'format': "PNG", 'max_kb': None}
+
+OUTPUT_FORMATS = ("Auto", "PNG", "JPEG", "WebP")
+
+FORMAT_DETAILS = {
+    "PNG": ("png", "image/png"),
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+}
+
+
+def _save(image, image_format, quality=None):
+    buffered = BytesIO()
+    options = {}
+    if quality is not None:
+        options['quality'] = quality
+    if image_format == "JPEG":
+        options['optimize'] = True
+    elif image_format == "WEBP":
+        options['method'] = 4
+    image.save(buffered, format=image_format, **options)
+    return buffered.getvalue()
+
+
+def _flatten(image, image_format):
+    # JPEG has no alpha channel; WebP and PNG keep it
+    if image_format == "JPEG" and image.mode != "RGB":
+        if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image.convert("RGBA"), mask=image.convert("RGBA"))
+            return background
+        return image.convert("RGB")
+    return image
+
+
+def encode_image(image, image_format="PNG", max_kb=None, min_quality=MIN_QUALITY, max_quality=MAX_QUALITY):
+    image_format = image_format.upper()
+    if image_format == "WEBP" and not features.check("webp"):
+        image_format = "JPEG"
+    image = _flatten(image, image_format)
+    budget_bytes = int(max_kb * 1024) if max_kb else None
+
+    quality = None
+    if image_format == "PNG":
+        data = _save(image, "PNG")
+    elif budget_bytes is None:
+        quality = max_quality
+        data = _save(image, image_format, quality)
+    else:
+        # Highest quality that fits; fall back to min_quality if nothing does.
+        # Most creatives fit at full quality, so try that before searching
+        best = None
+        candidate = _save(image, image_format, max_quality)
+        if len(candidate) <= budget_bytes:
+            best = (max_quality, candidate)
+        else:
+            low, high = min_quality, max_quality - 1
+            while low <= high:
+                middle = (low + high) // 2
+                candidate = _save(image, image_format, middle)
+                if len(candidate) <= budget_bytes:
+                    best = (middle, candidate)
+                    low = middle + 1
+                else:
+                    high = middle - 1
+        if best is None:
+            best = (min_quality, _save(image, image_format, min_quality))
+        quality, data = best
+
+    extension, mime = FORMAT_DETAILS[image_format]
+    return {
+        'data': data,
+        'format': image_format,
+        'extension': extension,
+        'mime': mime,
+        'quality': quality,
+        'bytes': len(data),
+        'budget_bytes': budget_bytes,
+        'within_budget': budget_bytes is None or len(data) <= budget_bytes,
+    }
+
+
+def profile_for(label, output_format="Auto", profiles=None):
+    # "Auto" uses the per-size profile; an explicit format keeps that size's budget
+    profile = (profiles or ENCODING_PROFILES).get(label, DEFAULT_PROFILE)
+    if output_format and output_format != "Auto":
+        profile = dict(profile, format=output_format)
+    return profile
+
+
+def encode_for_size(image, label, output_format="Auto", profiles=None):
+    profile = profile_for(label, output_format, profiles)
+    return encode_image(image, profile['format'], profile.get('max_kb'))
+
+
+def manifest_entry(path, encoded):
+    # What the manifest records about each written creative
+    return {
+        'path': path,
+        'format': encoded['format'],
+        'quality': encoded['quality'],
+        'bytes': encoded['bytes'],
+        'budget_bytes': encoded['budget_bytes'],
+        'within_budget': encoded['within_budget'],
+    }
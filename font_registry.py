@@ -0,0 +1,93 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import ImageFont
+
+# Process-wide font registry.
+#
+# Each font path is resolved once; sized FreeType fonts are cached by
+# (path, size) with LRU eviction. FreeType opens the file by path for every
+# size, so each cached size holds its own face (under 0.2 MB for the bundled
+# Arial) and MAX_SIZED_FONTS bounds the total.
+# Lookups are guarded by a lock so concurrent Streamlit sessions (which run on
+# separate threads of one process) share the same registry safely.
+
+DEFAULT_FONT_PATH = "arial.ttf"
+MAX_SIZED_FONTS = 256
+
+# The bundled font lives next to this module; fall back to it when a relative
+# path does not resolve from the current working directory
+BUNDLED_FONT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def resolve_font_path(font_path):
+    if os.path.exists(font_path):
+        return font_path
+    bundled = os.path.join(BUNDLED_FONT_DIR, font_path)
+    if not os.path.isabs(font_path) and os.path.exists(bundled):
+        return bundled
+    return None
+
+
+def load_default_font(font_size):
+    try:
+        return ImageFont.load_default(font_size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+class FontRegistry:
+    def __init__(self, max_sized_fonts=MAX_SIZED_FONTS):
+        self.max_sized_fonts = max_sized_fonts
+        self.hits = 0
+        self.misses = 0
+        self._paths = {}
+        self._sized = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _resolved_path(self, font_path):
+        # Called with the lock held
+        if font_path not in self._paths:
+            self._paths[font_path] = resolve_font_path(font_path)
+        return self._paths[font_path]
+
+    def get_font(self, font_size, font_path=DEFAULT_FONT_PATH):
+        key = (font_path, font_size)
+        with self._lock:
+            font = self._sized.get(key)
+            if font is not None:
+                self._sized.move_to_end(key)
+                self.hits += 1
+                return font
+
+            self.misses += 1
+            resolved = self._resolved_path(font_path)
+            if resolved is None:
+                font = load_default_font(font_size)
+            else:
+                font = ImageFont.truetype(resolved, font_size)
+            # Lets text_metrics measure this font from its glyph tables
+            font.registry_key = key
+
+            self._sized[key] = font
+            if len(self._sized) > self.max_sized_fonts:
+                self._sized.popitem(last=False)
+            return font
+
+    def preload(self, font_path=DEFAULT_FONT_PATH, sizes=()):
+        with self._lock:
+            self._resolved_path(font_path)
+        for font_size in sizes:
+            self.get_font(font_size, font_path)
+
+
+font_registry = FontRegistry()
+
+
+def get_font(font_size, font_path=DEFAULT_FONT_PATH):
+    return font_registry.get_font(font_size, font_path)
+
+
+# Find the bundled face as soon as any app imports the registry
+font_registry.preload(DEFAULT_FONT_PATH)
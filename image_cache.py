@@ -0,0 +1,305 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+
+import smart_crop
+from instrumentation import stage
+
+# Decode-once / resize-once cache for source photos.
+#
+# The variant loops visit the same photo and ad size once per CTA/description
+# pair. Decoded sources are cached by content hash and resized bases by
+# (content hash, dimensions, filter), so each source x size is only processed
+# once. Entries are evicted least-recently-used once the byte budget is hit.
+#
+# Sources are normalized on decode: EXIF orientation is applied and the mode
+# is converted to RGB (or RGBA for uploads with transparency).
+#
+# Cached images are shared between callers and must not be modified in place;
+# copy them first (render_engine.render_creative already does).
+#
+# Resizes go through a halving pyramid: level 0 is the decoded source and each
+# further level is the previous one box-reduced by 2, cached like any other
+# entry. An output size starts from the smallest level that is still at least
+# REDUCING_GAP times larger on both axes, so every ad size of a photo shares
+# the same few intermediates and only the last, short step runs a real filter
+# (chosen by resample_filter). benchmarks/bench_render.py records the PSNR of
+# this path against a direct LANCZOS resize from the source; set
+# ADCREATIVE_REDUCING_GAP=0 to resize straight from the source instead.
+#
+# With crop=True an output is cut to its own aspect ratio instead of being
+# stretched (see smart_crop.py). The saliency map behind the crop is computed
+# once per source from a small pyramid level and cached like the levels.
+
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+REDUCING_GAP = float(os.environ.get("ADCREATIVE_REDUCING_GAP", "2.0"))
+
+
+def read_source_bytes(source):
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if isinstance(source, str):
+        with open(source, "rb") as source_file:
+            return source_file.read()
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    position = source.tell()
+    source.seek(0)
+    data = source.read()
+    source.seek(position)
+    return data
+
+
+def largest_dimensions(dimensions_list):
+    # Smallest (width, height) that covers every requested output size
+    dimensions_list = list(dimensions_list)
+    if not dimensions_list:
+        return None
+    return max(width for width, _ in dimensions_list), max(height for _, height in dimensions_list)
+
+
+# EXIF orientation tag value -> transpose that puts the photo upright
+ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+EXIF_ORIENTATION = 0x0112
+
+
+def normalize_mode(image):
+    # Everything downstream draws on RGB, or RGBA when the upload has transparency
+    if image.mode in ("RGB", "RGBA"):
+        return image
+    if "A" in image.getbands() or "a" in image.getbands() or "transparency" in image.info:
+        return image.convert("RGBA")
+    return image.convert("RGB")
+
+
+def decode_reduced(image, decode_size=None):
+    # Decodes image upright, in RGB/RGBA and no larger than needed to cover
+    # decode_size. JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale (draft
+    # mode); other formats are decoded in full and then shrunk by an integer
+    # box reduce.
+    transpose = ORIENTATION_TRANSPOSES.get(image.getexif().get(EXIF_ORIENTATION))
+    if decode_size is None:
+        image.load()
+    else:
+        target_width, target_height = decode_size
+        if transpose in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                         Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270):
+            # decode_size is upright; the stored pixels are sideways
+            target_width, target_height = target_height, target_width
+        if image.format == "JPEG":
+            image.draft(image.mode, (target_width, target_height))
+        image.load()
+
+        factor = min(image.width // max(target_width, 1), image.height // max(target_height, 1))
+        if factor >= 2:
+            try:
+                image = image.reduce(factor)
+            except ValueError:
+                # reduce() does not support palette and some other modes
+                image = normalize_mode(image).reduce(factor)
+
+    image = normalize_mode(image)
+    if transpose is not None:
+        image = image.transpose(transpose)
+    return image
+
+
+def pyramid_level(size, dimensions, reducing_gap=REDUCING_GAP):
+    # Number of halvings of size that still leave reducing_gap headroom over dimensions
+    if reducing_gap <= 0:
+        return 0
+    width, height = size
+    level = 0
+    while width // 2 >= reducing_gap * dimensions[0] and height // 2 >= reducing_gap * dimensions[1]:
+        width, height = width // 2, height // 2
+        level += 1
+    return level
+
+
+def resample_filter(size, dimensions, resample=Image.LANCZOS):
+    # Filter for the last step from size to dimensions. Lanczos only pays for
+    # itself on gentle reductions, where it keeps edges sharper; on steps of
+    # 2x or more bicubic is as good for less work, and enlarging with Lanczos
+    # rings around edges.
+    scale = max(dimensions[0] / size[0], dimensions[1] / size[1])
+    if scale >= 1 or scale <= 0.5:
+        return Image.BICUBIC if resample == Image.LANCZOS else resample
+    return resample
+
+
+def fit_within(size, box):
+    # Size thumbnail() produces: the same aspect ratio inside box, never enlarged
+    scale = min(box[0] / size[0], box[1] / size[1], 1)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def image_nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class SourceCache:
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # Hashing a multi-megabyte upload per lookup would eat most of the win,
+        # so remember the digest of each file object / path we have seen
+        self._file_keys = weakref.WeakKeyDictionary()
+        self._path_keys = {}
+
+    def source_key(self, source):
+        if isinstance(source, (bytes, bytearray)):
+            return hashlib.sha1(source).hexdigest()
+
+        if isinstance(source, str):
+            stat = os.stat(source)
+            path_key = (os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+            with self._lock:
+                digest = self._path_keys.get(path_key)
+            if digest is None:
+                digest = hashlib.sha1(read_source_bytes(source)).hexdigest()
+                with self._lock:
+                    self._path_keys[path_key] = digest
+            return digest
+
+        try:
+            with self._lock:
+                digest = self._file_keys.get(source)
+        except TypeError:
+            return hashlib.sha1(read_source_bytes(source)).hexdigest()
+        if digest is None:
+            digest = hashlib.sha1(read_source_bytes(source)).hexdigest()
+            with self._lock:
+                self._file_keys[source] = digest
+        return digest
+
+    def _lookup(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def _store(self, key, image):
+        size = image_nbytes(image)
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            self._entries[key] = image
+            self.current_bytes += size
+            # Never evict the entry we just added, even if it alone exceeds the budget
+            while self.current_bytes > self.budget_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= image_nbytes(evicted)
+            return image
+
+    def get_source(self, source, decode_size=None):
+        # decode_size, if given, is the largest (width, height) any output
+        # needs; the source is decoded at the smallest scale that still covers it
+        decode_size = tuple(decode_size) if decode_size else None
+        key = ("source", self.source_key(source), decode_size)
+        image = self._lookup(key)
+        if image is None:
+            with stage("decode"):
+                if isinstance(source, str):
+                    image = Image.open(source)
+                else:
+                    image = Image.open(BytesIO(read_source_bytes(source)))
+                image = decode_reduced(image, decode_size)
+            image = self._store(key, image)
+        return image
+
+    def get_level(self, source, level, decode_size=None):
+        # Level `level` of the source's halving pyramid (0 is the decoded source)
+        if level == 0:
+            return self.get_source(source, decode_size)
+        decode_size = tuple(decode_size) if decode_size else None
+        key = ("level", self.source_key(source), decode_size, level)
+        image = self._lookup(key)
+        if image is None:
+            larger = self.get_level(source, level - 1, decode_size)
+            with stage("resize"):
+                image = larger.reduce(2)
+            image = self._store(key, image)
+        return image
+
+    def get_saliency(self, source, decode_size=None):
+        # smart_crop.saliency_map of the source, from the smallest pyramid
+        # level that still covers the analysis size
+        decode_size = tuple(decode_size) if decode_size else None
+        key = ("saliency", self.source_key(source), decode_size)
+        image = self._lookup(key)
+        if image is None:
+            source_image = self.get_source(source, decode_size)
+            analysis_size = fit_within(source_image.size, (smart_crop.ANALYSIS_SIZE, smart_crop.ANALYSIS_SIZE))
+            level = pyramid_level(source_image.size, analysis_size, 1)
+            with stage("saliency"):
+                image = smart_crop.saliency_map(self.get_level(source, level, decode_size))
+            image = self._store(key, image)
+        return image
+
+    def get_resized(self, source, dimensions, resample=Image.LANCZOS, decode_size=None, crop=False):
+        # crop=True cuts the source to the aspect ratio of dimensions around
+        # its most salient region instead of stretching it
+        dimensions = tuple(dimensions)
+        decode_size = tuple(decode_size) if decode_size else dimensions
+        key = ("resized", self.source_key(source), dimensions, resample, decode_size, bool(crop))
+        image = self._lookup(key)
+        if image is None:
+            source_image = self.get_source(source, decode_size)
+            box = None
+            if crop:
+                box = smart_crop.crop_box(self.get_saliency(source, decode_size), source_image.size, dimensions)
+            region = (box[2] - box[0], box[3] - box[1]) if box else source_image.size
+
+            base = self.get_level(source, pyramid_level(region, dimensions), decode_size)
+            if box:
+                # The crop box is in source pixels; scale it to the level
+                scale_x, scale_y = base.width / source_image.width, base.height / source_image.height
+                box = (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y)
+                region = (box[2] - box[0], box[3] - box[1])
+            else:
+                region = base.size
+            if REDUCING_GAP > 0:
+                resample = resample_filter(region, dimensions, resample)
+            with stage("resize"):
+                image = base.resize(dimensions, resample, box=box)
+            image = self._store(key, image)
+        return image
+
+    def get_thumbnail(self, source, box, resample=Image.BICUBIC, decode_size=None, crop=False):
+        # Cached, pyramid-backed equivalent of thumbnail(box) on a copy of the
+        # source; with crop=True the output fills box exactly (smart crop)
+        if crop:
+            return self.get_resized(source, box, resample, decode_size or box, crop=True)
+        source_image = self.get_source(source, decode_size or box)
+        return self.get_resized(source, fit_within(source_image.size, box), resample, decode_size or box)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+# Process-wide cache shared by the Streamlit apps and the batch renderer
+source_cache = SourceCache()
@@ -0,0 +1,186 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Per-stage render instrumentation.
+#
+# Render code wraps its stages in `with stage("decode"):` and bumps counters
+# with count("variants"). Timings, counters and peak resident memory collect
+# in the current job's RenderMetrics, which the apps show in a sidebar panel
+# (metrics_panel.py) and export as JSON or Prometheus text.
+#
+# The current job lives in a context variable, so every Streamlit session
+# (one thread each) collects into its own job; render_pipeline carries it
+# into its step threads. Collection is on only while a job is started: with
+# no job stage() hands back one shared no-op context manager and count()
+# returns straight away, so the wrapped render paths cost a function call and
+# a lookup. ADCREATIVE_METRICS=1 makes collecting the default. Worker
+# processes collect their own metrics per chunk and parallel_render merges
+# them into the parent's job.
+#
+# Peak memory is the highest resident set size sampled while the job ran (at
+# its start, after every stage and when it finishes). It is the whole
+# process's memory, so jobs of concurrent sessions count each other's.
+
+_NO_STAGE = nullcontext()
+_current = contextvars.ContextVar("render_metrics", default=None)
+
+
+def default_enabled():
+    return os.environ.get("ADCREATIVE_METRICS", "0") == "1"
+
+
+def enabled():
+    return _current.get() is not None
+
+
+def peak_rss_bytes():
+    # High-water mark over the whole life of the process
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # No procfs: the lifetime high-water mark is the best there is
+        return peak_rss_bytes()
+
+
+class RenderMetrics:
+    def __init__(self, job=None):
+        self.job = job
+        self.started = time.time()
+        self.ended = None
+        self.stages = {}
+        self.counters = {}
+        self.peak_rss_bytes = current_rss_bytes()
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def add_count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def sample_memory(self):
+        self.peak_rss_bytes = max(self.peak_rss_bytes, current_rss_bytes())
+
+    def finish(self):
+        # Ends the job; stages run afterwards in this context are not collected
+        self.ended = time.time()
+        self.sample_memory()
+        if _current.get() is self:
+            _current.set(None)
+        return self
+
+    def merge(self, snapshot):
+        # Folds in a snapshot() taken in another process
+        with self._lock:
+            for name, other in snapshot['stages'].items():
+                stats = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+                stats['count'] += other['count']
+                stats['seconds'] += other['seconds']
+                stats['max_seconds'] = max(stats['max_seconds'], other['max_seconds'])
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.peak_rss_bytes = max(self.peak_rss_bytes, snapshot['peak_rss_bytes'])
+
+    def snapshot(self):
+        if self.ended is None:
+            self.sample_memory()
+        with self._lock:
+            return {
+                'job': self.job,
+                'started': self.started,
+                'wall_seconds': (self.ended or time.time()) - self.started,
+                'stages': {name: dict(stats) for name, stats in self.stages.items()},
+                'counters': dict(self.counters),
+                'peak_rss_bytes': self.peak_rss_bytes,
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="adcreative"):
+        snapshot = self.snapshot()
+        label = f'{{job="{snapshot["job"] or ""}"}}'
+        lines = []
+        # Samples of one metric family have to be contiguous, after its TYPE line
+        for family, kind, field, value_format in (("stage_seconds_total", "counter", 'seconds', "{:.6f}"),
+                                                  ("stage_calls_total", "counter", 'count', "{}"),
+                                                  ("stage_max_seconds", "gauge", 'max_seconds', "{:.6f}")):
+            lines.append(f"# TYPE {prefix}_{family} {kind}")
+            for name, stats in sorted(snapshot['stages'].items()):
+                stage_label = f'{{job="{snapshot["job"] or ""}",stage="{name}"}}'
+                lines.append(f"{prefix}_{family}{stage_label} {value_format.format(stats[field])}")
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total{label} {value}")
+        lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+        lines.append(f"{prefix}_peak_rss_bytes{label} {snapshot['peak_rss_bytes']}")
+        lines.append(f"# TYPE {prefix}_job_wall_seconds gauge")
+        lines.append(f"{prefix}_job_wall_seconds{label} {snapshot['wall_seconds']:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+class _Stage:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+        self.metrics.sample_memory()
+        return False
+
+
+def current_metrics():
+    # The job collecting in this context, or None
+    return _current.get()
+
+
+def start_job(job=None):
+    # Starts collecting a fresh set of metrics for one render job in the
+    # current context and returns it; RenderMetrics.finish() ends it
+    metrics = RenderMetrics(job)
+    _current.set(metrics)
+    return metrics
+
+
+def stage(name):
+    metrics = _current.get()
+    if metrics is None:
+        return _NO_STAGE
+    return _Stage(metrics, name)
+
+
+def count(name, amount=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_count(name, amount)
@@ -1,34 +1,43 @@
-import os
+import json
 import streamlit as st
-import base64
-from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
+from editor_pages import background_url, select_page
+from image_cache import largest_dimensions, source_cache
+from layout_templates import editor_offsets
+from instrumentation import stage, start_job
+from metrics_panel import metrics_toggle, show_metrics
+from upload_ingest import ingest_images, ingest_logo
+from parallel_render import default_workers
+from preview_gallery import PreviewGallery
+from encoders import OUTPUT_FORMATS, manifest_entry
+from render_engine import IMAGE_SIZES, context_digest, render_context, render_variant_file, variant_task
+from render_memo import memoized_map, shared_memo, variant_key
+from variant_planner import describe_plan, plan_variants
+from zip_export import ZipExport, archive_path
 
 # Main function to handle the Streamlit app logic
 def main():
     st.title("Image Text and Logo Overlay App")
+    collect_metrics = metrics_toggle()
+    job_metrics = None
 
     uploaded_images = st.file_uploader("Upload multiple images", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
     uploaded_logo = st.file_uploader("Upload logo image", type=["jpg", "jpeg", "png"])
 
-    logo_base64 = None
-    logo_image = None
-    if uploaded_logo:
-        logo = Image.open(uploaded_logo)
-        logo = logo.convert("RGBA")  # Ensure logo is in RGBA format
-        buffered_logo = BytesIO()
-        logo.save(buffered_logo, format="PNG")
-        logo_base64 = base64.b64encode(buffered_logo.getvalue()).decode()
-        logo_image = logo
+    uploaded_images, image_previews, duplicate_names = ingest_images(uploaded_images)
+    logo_url, logo_png = ingest_logo(uploaded_logo)
+
+    if duplicate_names:
+        st.warning(f"Skipped duplicate uploads: {', '.join(duplicate_names)}")
 
     if uploaded_images:
         st.write("Images uploaded successfully!")
-        for uploaded_image in uploaded_images:
-            st.image(uploaded_image, caption="Uploaded Image", use_column_width=True)
+        for preview in image_previews:
+            st.image(preview, caption="Uploaded Image", use_column_width=True)
 
     if uploaded_logo:
         st.write("Logo uploaded successfully!")
-        st.image(uploaded_logo, caption="Uploaded Logo", use_column_width=True)
+        st.image(logo_png, caption="Uploaded Logo", use_column_width=True)
 
     num_pairs = st.number_input("Number of Call to Action + Description Pairs", min_value=1, step=1)
     call_to_action_texts = [st.text_input(f"Call to Action Text {i + 1}") for i in range(num_pairs)]
@@ -45,28 +54,7 @@ def main():
     # Option to choose the shape of the text containers
     text_shape = st.selectbox("Select Text Container Shape", ["Rectangle", "Pill-shaped"])
 
-    image_sizes = {
-        "IP Targeting": {
-            "300x250": (300, 250),
-            "728x90": (728, 90),
-        },
-        "Mobile Footprinting": {
-            "300x250": (300, 250),
-            "728x90": (728, 90),
-        },
-        "Audience Select": {
-            "300x250": (300, 250),
-            "728x90": (728, 90),
-        },
-        "Spotify": {
-            "640x640": (640, 640),
-            "300x250": (300, 250),
-        },
-        "YouTube": {
-            "1280x720": (1280, 720),
-            "300x250": (300, 250),
-        },
-    }
+    image_sizes = IMAGE_SIZES
 
     selected_image_sizes = []
     for channel, sizes in image_sizes.items():
@@ -76,70 +64,107 @@ def main():
                 if st.checkbox(label, key=f"{channel}_{label}"):
                     selected_image_sizes.append((channel, label, dimensions))
 
-    if st.button("Merge and Download"):
+    # Auto picks JPEG with a file-size budget per ad size (see encoders.ENCODING_PROFILES)
+    output_format = st.selectbox("Output Format", OUTPUT_FORMATS)
+
+    # Cut each size to its own aspect ratio around the photo's subject instead of stretching it
+    crop_to_size = st.checkbox("Smart crop to each size")
+
+    parallel_rendering = st.checkbox("Render in parallel", value=True)
+    workers = default_workers() if parallel_rendering else 1
+
+    # One default placement per creative; mixing crosses every CTA with every description
+    num_text_pairs = len(call_to_action_texts) * (len(description_texts) if mix_cta_desc == "Yes" else 1)
+    plan = plan_variants(len(uploaded_images or []), num_text_pairs, 1,
+                         [dimensions for _, _, dimensions in selected_image_sizes], workers=workers)
+    st.caption(f"Planned: {describe_plan(plan)}")
+    for problem in plan['over_limits']:
+        st.error(f"Too many variants: {problem}. Select fewer texts or sizes.")
+
+    if st.button("Merge and Download", disabled=bool(plan['over_limits'])):
         if uploaded_images:
+            if collect_metrics:
+                job_metrics = start_job("lastworking")
             st.write("Processing images...")
 
             images_data = []
+            # Every size is resized from one reduced decode that covers the largest of them
+            decode_size = largest_dimensions(dimensions for _, _, dimensions in selected_image_sizes)
 
             if mix_cta_desc == "Yes":
                 # Produce all combinations of CTA and Description
                 for call_to_action_text in call_to_action_texts:
                     for description_text in description_texts:
-                        for image in uploaded_images:
+                        for source_index, image in enumerate(uploaded_images):
                             for channel, label, dimensions in selected_image_sizes:
-                                img = Image.open(image)
-                                img_resized = img.resize(dimensions, Image.LANCZOS)
-                                buffered = BytesIO()
-                                img_resized.save(buffered, format="PNG")
-                                img_base64 = base64.b64encode(buffered.getvalue()).decode()
+                                img_resized = source_cache.get_resized(image, dimensions, Image.LANCZOS, decode_size, crop=crop_to_size)
 
                                 images_data.append({
-                                    'img_base64': img_base64,
                                     'call_to_action_text': call_to_action_text,
                                     'description_text': description_text,
-                                    'logo_base64': logo_base64 if uploaded_logo else None,
+                                    'logo_url': logo_url,
                                     'cta_bg_color': call_to_action_bg_color,
                                     'cta_text_color': call_to_action_text_color,
                                     'desc_bg_color': description_bg_color,
                                     'desc_text_color': description_text_color,
                                     'text_shape': text_shape,
-                                    'image': img_resized
+                                    'image': img_resized,
+                                    'source_index': source_index,
+                                    'channel': channel,
+                                    'label': label,
+                                    'dimensions': dimensions
                                 })
             else:
                 # Produce images without mixing CTAs and Descriptions
                 for call_to_action_text, description_text in zip(call_to_action_texts, description_texts):
-                    for image in uploaded_images:
+                    for source_index, image in enumerate(uploaded_images):
                         for channel, label, dimensions in selected_image_sizes:
-                            img = Image.open(image)
-                            img_resized = img.resize(dimensions, Image.LANCZOS)
-                            buffered = BytesIO()
-                            img_resized.save(buffered, format="PNG")
-                            img_base64 = base64.b64encode(buffered.getvalue()).decode()
+                            img_resized = source_cache.get_resized(image, dimensions, Image.LANCZOS, decode_size, crop=crop_to_size)
 
                             images_data.append({
-                                'img_base64': img_base64,
                                 'call_to_action_text': call_to_action_text,
                                 'description_text': description_text,
-                                'logo_base64': logo_base64 if uploaded_logo else None,
+                                'logo_url': logo_url,
                                 'cta_bg_color': call_to_action_bg_color,
                                 'cta_text_color': call_to_action_text_color,
                                 'desc_bg_color': description_bg_color,
                                 'desc_text_color': description_text_color,
                                 'text_shape': text_shape,
-                                'image': img_resized
+                                'image': img_resized,
+                                'source_index': source_index,
+                                'channel': channel,
+                                'label': label,
+                                'dimensions': dimensions
                             })
 
-            add_draggable_functionality(images_data, dimensions[0], dimensions[1])
+            # Keep the variants so the editor can page through them on later reruns
+            st.session_state['images_data'] = images_data
+            st.session_state['editor_dimensions'] = dimensions
 
             # Trigger the download after rendering and manipulation
-            save_and_download_images(images_data, logo_image)
+            save_and_download_images(images_data, uploaded_logo, uploaded_images, workers, output_format, crop_to_size)
+
+    if st.session_state.get('images_data'):
+        editor_width, editor_height = st.session_state['editor_dimensions']
+        add_draggable_functionality(st.session_state['images_data'], editor_width, editor_height)
+
+    if job_metrics is not None:
+        st.session_state['render_metrics'] = job_metrics.finish()
+    if collect_metrics:
+        show_metrics()
 
 def add_draggable_functionality(images_data, img_width, img_height):
+    # Only the selected page of variants is turned into HTML
+    start, end = select_page(len(images_data))
+    with stage("html"):
+        html = editor_html(images_data, img_width, img_height, start, end)
+    st.components.v1.html(html, height=img_height * (end - start) + 300)
+
+def editor_html(images_data, img_width, img_height, start, end):
     html_parts = []
 
-    # Iterate over each image and its associated data
-    for index, data in enumerate(images_data):
+    for index in range(start, end):
+        data = images_data[index]
         cta_id = f"ctaText_{index}"
         desc_id = f"descText_{index}"
         logo_id = f"logoImage_{index}"
@@ -150,17 +175,20 @@ def add_draggable_functionality(images_data, img_width, img_height):
         else:
             border_radius = "0px"  # Rectangle
 
+        # Start from the default template's placements for this editor size
+        offsets = editor_offsets(data['call_to_action_text'], data['description_text'], (img_width, img_height), 12, 20)
+
         # Generate HTML for each image
         html_part = f"""
-            <div id="imageContainer_{index}" style="position: relative; width: {img_width}px; height: {img_height}px; background-image: url('data:image/png;base64,{data['img_base64']}'); background-size: contain; background-repeat: no-repeat;">
-                <div id="{cta_id}" class="draggable resizable" style="position: absolute; top: 50px; left: 50px; background-color:{data['cta_bg_color']}; color:{data['cta_text_color']}; padding: 10px; font-size: 16px; display: inline-block; border-radius: {border_radius}; border: 2px solid {data['cta_bg_color']};">
+            <div id="imageContainer_{index}" style="position: relative; width: {img_width}px; height: {img_height}px; background-image: url('{background_url(data)}'); background-size: contain; background-repeat: no-repeat;">
+                <div id="{cta_id}" class="draggable resizable" style="position: absolute; top: {offsets['cta'][1]}px; left: {offsets['cta'][0]}px; background-color:{data['cta_bg_color']}; color:{data['cta_text_color']}; padding: 10px; font-size: 16px; display: inline-block; border-radius: {border_radius}; border: 2px solid {data['cta_bg_color']};">
                     {data['call_to_action_text']}
                 </div>
-                <div id="{desc_id}" class="draggable resizable" style="position: absolute; top: 150px; left: 50px; background-color:{data['desc_bg_color']}; color:{data['desc_text_color']}; padding: 10px; font-size: 16px; display: inline-block; border-radius: {border_radius}; border: 2px solid {data['desc_bg_color']};">
+                <div id="{desc_id}" class="draggable resizable" style="position: absolute; top: {offsets['desc'][1]}px; left: {offsets['desc'][0]}px; background-color:{data['desc_bg_color']}; color:{data['desc_text_color']}; padding: 10px; font-size: 16px; display: inline-block; border-radius: {border_radius}; border: 2px solid {data['desc_bg_color']};">
                     {data['description_text']}
                 </div>
-                <div id="{logo_id}" class="draggable resizable logo-grabbable" style="position: absolute; top: 250px; left: 50px; padding: 20px; cursor: move; display: inline-block; opacity: 1;">
-                    <img src="data:image/png;base64,{data['logo_base64']}" style="width: 100%; height: auto; pointer-events: none;">
+                <div id="{logo_id}" class="draggable resizable logo-grabbable" style="position: absolute; top: {offsets['logo'][1]}px; left: {offsets['logo'][0]}px; width: {offsets['logo_width']}px; padding: 20px; cursor: move; display: inline-block; opacity: 1;">
+                    <img src="{data['logo_url']}" style="width: 100%; height: auto; pointer-events: none;">
                 </div>
             </div>
             <div style="margin-top: 10px;">
@@ -256,7 +284,7 @@ def add_draggable_functionality(images_data, img_width, img_height):
 
             // Apply interactions to each element with unique IDs
     """
-    for index in range(len(images_data)):
+    for index in range(start, end):
         js_part += f"""
             applyInteractions('ctaText_{index}');
             applyInteractions('descText_{index}');
@@ -271,58 +299,53 @@ def add_draggable_functionality(images_data, img_width, img_height):
     """
 
     # Combine HTML and JS into the final component
-    st.components.v1.html(html_content + js_part, height=img_height * len(images_data) + 300)
-
-def save_and_download_images(images_data, logo_image):
-    for index, data in enumerate(images_data):
-        img = data['image']
-        draw = ImageDraw.Draw(img)
-
-        # Font settings
-        font_path = "arial.ttf"  # Update with the path to a valid .ttf font file if necessary
-        font_size = 20
-        font = ImageFont.truetype(font_path, font_size) if os.path.exists(font_path) else ImageFont.load_default()
-
-        # Calculate text size and position
-        cta_text_bbox = draw.textbbox((0, 0), data['call_to_action_text'], font=font)
-        desc_text_bbox = draw.textbbox((0, 0), data['description_text'], font=font)
-
-        cta_text_size = (cta_text_bbox[2] - cta_text_bbox[0], cta_text_bbox[3] - cta_text_bbox[1])
-        desc_text_size = (desc_text_bbox[2] - desc_text_bbox[0], desc_text_bbox[3] - desc_text_bbox[1])
-
-        cta_position = (50, 50)
-        desc_position = (50, 150)
-
-        # Draw the CTA and Description texts with background
-        draw.rectangle(
-            [cta_position, (cta_position[0] + cta_text_size[0] + 20, cta_position[1] + cta_text_size[1] + 10)],
-            fill=data['cta_bg_color'],
-            outline=data['cta_bg_color'],
-        )
-        draw.text((cta_position[0] + 10, cta_position[1] + 5), data['call_to_action_text'], fill=data['cta_text_color'], font=font)
-
-        draw.rectangle(
-            [desc_position, (desc_position[0] + desc_text_size[0] + 20, desc_position[1] + desc_text_size[1] + 10)],
-            fill=data['desc_bg_color'],
-            outline=data['desc_bg_color'],
-        )
-        draw.text((desc_position[0] + 10, desc_position[1] + 5), data['description_text'], fill=data['desc_text_color'], font=font)
-
-        # Place the logo on the image
-        if logo_image:
-            logo_position = (50, 250)
-            logo_resized = logo_image.resize((100, 100), Image.LANCZOS)
-            img.paste(logo_resized, logo_position, logo_resized)
-
-        # Save the image to a BytesIO object
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-
-        # Display download link
-        st.markdown(
-            f'<a href="data:image/png;base64,{img_str}" download="final_image_{index}.png">Download final_image_{index}.png</a>',
-            unsafe_allow_html=True
+    return html_content + js_part
+
+def save_and_download_images(images_data, uploaded_logo, uploaded_images, workers=1, output_format="Auto",
+                             smart_crop=False):
+    context = render_context(
+        {'logo': uploaded_logo.getvalue() if uploaded_logo else None, 'output_format': output_format,
+         'decode_size': largest_dimensions(data['dimensions'] for data in images_data), 'smart_crop': smart_crop},
+        sources={index: image.getvalue() for index, image in enumerate(uploaded_images)},
+    )
+    tasks = [variant_task(data) for data in images_data]
+
+    progress_bar = st.progress(0.0, text="Rendering creatives...")
+    def report_progress(done, total):
+        progress_bar.progress(done / total, text=f"Rendered {done} of {total} creatives")
+    # Results arrive chunk by chunk; the first ones are previewed while the rest render
+    gallery = PreviewGallery(len(tasks))
+
+    manifest = []
+    with ZipExport() as export:
+        def add_to_archive(index, encoded):
+            if encoded is not None:
+                task = tasks[index]
+                filename = f"final_image_{index}.{encoded['extension']}"
+                with stage("zip"):
+                    export.add_variant(task['channel'], task['label'], filename, encoded['data'])
+                manifest.append(manifest_entry(archive_path(task['channel'], task['label'], filename), encoded))
+                gallery.show(encoded['data'], caption=f"{task['channel']} {task['label']}")
+
+        # Only variants whose inputs changed since the last run (in any session) are rendered again
+        source_digests = [source_cache.source_key(image) for image in uploaded_images]
+        settings_digest = context_digest(context)
+        keys = [variant_key(task, source_digests[task['source_index']], settings_digest) for task in tasks]
+        errors = memoized_map(shared_memo, keys, render_variant_file, tasks, context, workers=workers,
+                              progress=report_progress, on_result=add_to_archive)
+        for index, message in errors:
+            st.error(f"final_image_{index} failed: {message}")
+        for entry in manifest:
+            if not entry['within_budget']:
+                st.warning(f"{entry['path']} is {entry['bytes'] // 1024} KB, over its {entry['budget_bytes'] // 1024} KB budget")
+
+        export.add("manifest.json", json.dumps(manifest, indent=2).encode())
+
+        st.download_button(
+            f"Download all ({len(manifest)} creatives)",
+            data=export.finish(),
+            file_name="creatives.zip",
+            mime="application/zip",
         )
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+import math
+import threading
+
+from text_fit import measure_text_size
+
+# Layout templates in normalized coordinates.
+#
+# A template places each element (CTA, description, logo) by a reference
+# point given as a fraction of the image size and an anchor on the element
+# itself: anchor (0, 0) puts the element's top-left corner on the point,
+# (1, 1) its bottom-right corner, (0.5, 0.5) its centre. Elements are kept
+# `margin` pixels away from whichever image edge their anchor faces. Logo
+# boxes are a fraction of the image's shorter side, so they stay square.
+#
+# Compiling a template for one ad size turns this into a placement table of
+# per-element constants; placing an element of a given size is then one
+# multiply-add per axis. Compiled tables are cached per (template, size) and
+# shared by every variant of that size, so one template drives every size.
+
+DEFAULT_MARGIN = 10
+
+# Font size the HTML editors start their text boxes at (CSS pixels)
+EDITOR_FONT_SIZE = 16
+
+# The nine named positions the apps offer; point and anchor coincide
+POSITION_ANCHORS = {
+    "top-left": (0.0, 0.0),
+    "top-center": (0.5, 0.0),
+    "top-right": (1.0, 0.0),
+    "middle-left": (0.0, 0.5),
+    "middle-center": (0.5, 0.5),
+    "middle-right": (1.0, 0.5),
+    "bottom-left": (0.0, 1.0),
+    "bottom-center": (0.5, 1.0),
+    "bottom-right": (1.0, 1.0),
+}
+
+
+class Placement:
+    # One element of a template compiled for one image size
+    def __init__(self, point, anchor, dimensions, margin=DEFAULT_MARGIN, box=None):
+        width, height = dimensions
+        self.anchor = anchor
+        # Reference point in pixels, pulled in by the margin on the anchored side
+        self.reference = (point[0] * width + (1 - 2 * anchor[0]) * margin,
+                          point[1] * height + (1 - 2 * anchor[1]) * margin)
+        self.box = box
+
+    def place(self, size):
+        # Top-left corner for an element of the given (width, height)
+        return (math.floor(self.reference[0] - self.anchor[0] * size[0]),
+                math.floor(self.reference[1] - self.anchor[1] * size[1]))
+
+
+class LayoutTemplate:
+    def __init__(self, elements, margin=DEFAULT_MARGIN):
+        # elements: name -> {'position': named position} or {'point': (x, y),
+        # 'anchor': (x, y)}, optionally with 'box': (width, height) as a
+        # fraction of the shorter image side
+        self.elements = {}
+        for name, element in elements.items():
+            if 'position' in element:
+                anchor = POSITION_ANCHORS[element['position']]
+                element = dict(element, point=anchor, anchor=anchor)
+            self.elements[name] = element
+        self.margin = margin
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def compile(self, dimensions):
+        # Placement table for one ad size: name -> Placement
+        dimensions = tuple(dimensions)
+        with self._lock:
+            table = self._compiled.get(dimensions)
+        if table is None:
+            shorter_side = min(dimensions)
+            table = {}
+            for name, element in self.elements.items():
+                box = element.get('box')
+                if box is not None:
+                    box = (max(1, round(box[0] * shorter_side)), max(1, round(box[1] * shorter_side)))
+                table[name] = Placement(element['point'], element['anchor'], dimensions,
+                                        element.get('margin', self.margin), box)
+            with self._lock:
+                self._compiled[dimensions] = table
+        return table
+
+
+# CTA top-left, description bottom-left, logo top-right
+DEFAULT_TEMPLATE = LayoutTemplate({
+    'cta': {'position': "top-left"},
+    'desc': {'position': "bottom-left"},
+    'logo': {'position': "top-right", 'box': (0.3, 0.3)},
+})
+
+_position_templates = {}
+_position_templates_lock = threading.Lock()
+
+
+def position_placement(position, dimensions, margin=DEFAULT_MARGIN):
+    # Compiled placement for one of the named positions at one image size
+    key = (position, margin)
+    with _position_templates_lock:
+        template = _position_templates.get(key)
+        if template is None:
+            template = _position_templates[key] = LayoutTemplate({position: {'position': position}}, margin)
+    return template.compile(dimensions)[position]
+
+
+def editor_offsets(cta_text, desc_text, dimensions, text_padding, logo_padding=0, template=DEFAULT_TEMPLATE):
+    # CSS left/top of the editor's elements (and the logo width), so the HTML
+    # editor opens on the same layout the final render uses. text_padding and
+    # logo_padding are each box's CSS padding plus border.
+    placements = template.compile(dimensions)
+    offsets = {}
+    for name, text in (('cta', cta_text), ('desc', desc_text)):
+        text_width, text_height = measure_text_size(text, EDITOR_FONT_SIZE)
+        # Browsers lay text out on a line box of about 1.2em
+        text_height = max(text_height, round(EDITOR_FONT_SIZE * 1.2))
+        offsets[name] = placements[name].place((text_width + 2 * text_padding, text_height + 2 * text_padding))
+    logo_width, logo_height = placements['logo'].box
+    offsets['logo'] = placements['logo'].place((logo_width + 2 * logo_padding, logo_height + 2 * logo_padding))
+    offsets['logo_width'] = logo_width
+    return offsets
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+
+from image_cache import read_source_bytes, source_cache
+
+# Logo asset stage.
+#
+# A logo is decoded once per upload (keyed by content hash) and kept with
+# premultiplied alpha, which is what Pillow resamples RGBA images in anyway.
+# Scaled copies are cached per target box, so every variant of a channel size
+# gets its logo from a ready-made entry instead of decoding and resizing again.
+
+MAX_CACHED_LOGOS = 16
+MAX_SCALED_PER_LOGO = 64
+
+
+class LogoAsset:
+    def __init__(self, image):
+        # "RGBa" is Pillow's premultiplied-alpha mode
+        self.premultiplied = image.convert("RGBA").convert("RGBa")
+        self.size = self.premultiplied.size
+        self._scaled = OrderedDict()
+        self._lock = threading.Lock()
+
+    def scaled(self, box, resample=Image.LANCZOS):
+        # Returns an RGBA logo resized to exactly box; shared, do not modify
+        key = (tuple(box), resample)
+        with self._lock:
+            logo = self._scaled.get(key)
+            if logo is not None:
+                self._scaled.move_to_end(key)
+                return logo
+
+        logo = self.premultiplied.resize(tuple(box), resample).convert("RGBA")
+        with self._lock:
+            self._scaled[key] = logo
+            if len(self._scaled) > MAX_SCALED_PER_LOGO:
+                self._scaled.popitem(last=False)
+        return logo
+
+
+_assets = OrderedDict()
+_assets_lock = threading.Lock()
+
+
+def get_logo_asset(source):
+    # source may be a path, bytes or an uploaded file object
+    key = source_cache.source_key(source)
+    with _assets_lock:
+        asset = _assets.get(key)
+        if asset is not None:
+            _assets.move_to_end(key)
+            return asset
+
+    if isinstance(source, str):
+        image = Image.open(source)
+    else:
+        image = Image.open(BytesIO(read_source_bytes(source)))
+    asset = LogoAsset(image)
+
+    with _assets_lock:
+        _assets[key] = asset
+        if len(_assets) > MAX_CACHED_LOGOS:
+            _assets.popitem(last=False)
+    return asset
+
+
+def clear_logo_assets():
+    with _assets_lock:
+        _assets.clear()
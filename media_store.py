@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Content-addressed media store.
+#
+# Rendered and resized images are kept in memory under their SHA-256 digest and
+# served over a small local HTTP server, so editor HTML can reference a short
+# URL instead of carrying every PNG through the Streamlit websocket as a
+# base64 data URI. URLs never change for a given content, so responses are
+# marked immutable and carry the digest as their ETag.
+#
+# The server is off unless configured: its URLs only work when the browser can
+# reach it, which a default 127.0.0.1 binding only allows on the server
+# machine itself (and plain http is blocked as mixed content behind https).
+# Without it media_url returns data URIs.
+#
+# Configuration (environment variables):
+#   ADCREATIVE_MEDIA_SERVER    "1" to serve on the bound address (local use)
+#   ADCREATIVE_MEDIA_URL       public base URL when the server sits behind a
+#                              proxy; setting it also turns the server on
+#   ADCREATIVE_MEDIA_HOST      interface to bind (default 127.0.0.1)
+#   ADCREATIVE_MEDIA_PORT      port to bind (default: any free port)
+
+DEFAULT_BUDGET_BYTES = 512 * 1024 * 1024
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+}
+
+
+class MediaStore:
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.current_bytes = 0
+        self._blobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, data, mime="image/png"):
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+                return digest
+            self._blobs[digest] = (data, mime)
+            self.current_bytes += len(data)
+            while self.current_bytes > self.budget_bytes and len(self._blobs) > 1:
+                _, (evicted, _) = self._blobs.popitem(last=False)
+                self.current_bytes -= len(evicted)
+        return digest
+
+    def get(self, digest):
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is not None:
+                self._blobs.move_to_end(digest)
+            return blob
+
+
+class _MediaRequestHandler(BaseHTTPRequestHandler):
+    store = None
+
+    def do_GET(self):
+        # /media/<digest>.<ext>
+        name = self.path.split("?")[0].rsplit("/", 1)[-1]
+        digest = name.split(".")[0]
+        blob = self.store.get(digest)
+        if blob is None:
+            self.send_error(404)
+            return
+
+        etag = f'"{digest}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        data, mime = blob
+        self.send_response(200)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+media_store = MediaStore()
+_server = None
+_base_url = None
+_server_lock = threading.Lock()
+
+
+def server_enabled():
+    if os.environ.get("ADCREATIVE_MEDIA_SERVER") == "0":
+        return False
+    return bool(os.environ.get("ADCREATIVE_MEDIA_URL")) or os.environ.get("ADCREATIVE_MEDIA_SERVER") == "1"
+
+
+def base_url():
+    # Starts the server on first use; one per process, shared by all sessions
+    global _server, _base_url
+    with _server_lock:
+        if _server is None:
+            host = os.environ.get("ADCREATIVE_MEDIA_HOST", "127.0.0.1")
+            port = int(os.environ.get("ADCREATIVE_MEDIA_PORT", "0"))
+            handler = type("MediaRequestHandler", (_MediaRequestHandler,), {"store": media_store})
+            _server = ThreadingHTTPServer((host, port), handler)
+            threading.Thread(target=_server.serve_forever, name="media-store", daemon=True).start()
+            bound_host, bound_port = _server.server_address[:2]
+            _base_url = os.environ.get("ADCREATIVE_MEDIA_URL", f"http://{bound_host}:{bound_port}").rstrip("/")
+        return _base_url
+
+
+def media_url(data, mime="image/png"):
+    # Short URL for the blob, or a data URI when the media server is disabled
+    if not server_enabled():
+        return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+    digest = media_store.put(data, mime)
+    return f"{base_url()}/media/{digest}.{EXTENSIONS.get(mime, 'bin')}"
+
+
+def url_servable(url):
+    # False once the blob behind a media URL has been evicted; data URIs
+    # always are. Checking also marks the blob as recently used.
+    if url.startswith("data:"):
+        return True
+    digest = url.rsplit("/", 1)[-1].split(".")[0]
+    return media_store.get(digest) is not None
@@ -0,0 +1,38 @@
+import streamlit as st
+
+from instrumentation import default_enabled
+
+# Sidebar panel for the render instrumentation (see instrumentation.py).
+#
+# The switch belongs to the session: it decides whether this session's next
+# render starts a metrics job, and ADCREATIVE_METRICS=1 only turns it on by
+# default. The metrics of the last render job are kept in
+# st.session_state['render_metrics'].
+
+
+def metrics_toggle(key="collect_render_metrics"):
+    # Only says whether this session starts a job for its next render
+    return st.sidebar.checkbox("Collect render metrics", value=default_enabled(), key=key)
+
+
+def show_metrics(metrics=None):
+    metrics = metrics or st.session_state.get('render_metrics')
+    if metrics is None:
+        return
+    snapshot = metrics.snapshot()
+    with st.sidebar.expander("Render metrics", expanded=True):
+        st.caption(f"{snapshot['job'] or 'render'}: {snapshot['wall_seconds']:.2f} s wall, "
+                   f"peak memory {snapshot['peak_rss_bytes'] / (1024 * 1024):.0f} MB")
+        st.table([{
+            'stage': name,
+            'calls': stats['count'],
+            'total s': round(stats['seconds'], 3),
+            'mean ms': round(stats['seconds'] / stats['count'] * 1000, 2),
+            'max ms': round(stats['max_seconds'] * 1000, 2),
+        } for name, stats in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['seconds'])])
+        for name, value in sorted(snapshot['counters'].items()):
+            st.write(f"{name}: {value}")
+        st.download_button("Download JSON", data=metrics.to_json(), file_name="render_metrics.json",
+                           mime="application/json", key="render_metrics_json")
+        st.download_button("Download Prometheus text", data=metrics.to_prometheus(), file_name="render_metrics.prom",
+                           mime="text/plain", key="render_metrics_prometheus")
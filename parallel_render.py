@@ -0,0 +1,161 @@
+import importlib
+import math
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from instrumentation import current_metrics, enabled as metrics_enabled, start_job
+
+# Shards a list of render tasks across a process pool.
+#
+# Results come back in task order no matter which worker finishes first, and a
+# failing task is recorded as an error for that index instead of aborting the
+# whole run. Shared inputs (source photo bytes, the logo, colors...) are sent
+# once per worker as the "context" rather than once per task.
+#
+# The task function must be importable by the worker processes. Streamlit runs
+# app scripts as __main__, so apps pass it as a "module:function" string.
+# Workers are started from a fork server (spawned where that is unavailable)
+# rather than forked from the caller: Streamlit and the media store run other
+# threads, and a forked child could inherit a lock one of them holds.
+#
+# A batch_func, if given, is called once per chunk as batch_func(tasks, context)
+# and returns one result per task; it lets a chunk share work between its
+# tasks (render_engine.render_variant_files composites same-size creatives
+# together). If it raises, the chunk is rerun task by task with func so the
+# failure is pinned on the task that caused it.
+
+DEFAULT_CHUNK_SIZE = 8
+
+_worker_func = None
+_worker_batch_func = None
+_worker_context = None
+_worker_collect_metrics = False
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def pool_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def resolve_func(func):
+    if isinstance(func, str):
+        module_name, func_name = func.split(":")
+        return getattr(importlib.import_module(module_name), func_name)
+    return func
+
+
+def _init_worker(func, context, collect_metrics=False, batch_func=None):
+    # Pool processes only: the calling process may run several maps at once
+    # (one per Streamlit session thread), so it never keeps them in globals
+    global _worker_func, _worker_batch_func, _worker_context, _worker_collect_metrics
+    _worker_func = resolve_func(func)
+    _worker_batch_func = resolve_func(batch_func) if batch_func else None
+    _worker_context = context
+    _worker_collect_metrics = collect_metrics
+
+
+def _run_chunk(start, tasks, func, batch_func, context):
+    if batch_func is not None and len(tasks) > 1:
+        try:
+            batch_results = batch_func(tasks, context)
+            return [(start + offset, result, None) for offset, result in enumerate(batch_results)]
+        except Exception:
+            pass
+    results = []
+    for offset, task in enumerate(tasks):
+        try:
+            results.append((start + offset, func(task, context), None))
+        except Exception as error:
+            message = "".join(traceback.format_exception_only(type(error), error)).strip()
+            results.append((start + offset, None, message))
+    return results
+
+
+def _run_chunk_in_worker(start, tasks):
+    # Metrics collected for just this chunk travel back with its results
+    if not _worker_collect_metrics:
+        return _run_chunk(start, tasks, _worker_func, _worker_batch_func, _worker_context), None
+    metrics = start_job()
+    results = _run_chunk(start, tasks, _worker_func, _worker_batch_func, _worker_context)
+    return results, metrics.finish().snapshot()
+
+
+def chunked(tasks, chunk_size):
+    for start in range(0, len(tasks), chunk_size):
+        yield start, tasks[start:start + chunk_size]
+
+
+class _OrderedResults:
+    # Collects chunk results as they arrive and releases them to on_result in
+    # task order, so streaming consumers see a deterministic sequence
+    def __init__(self, total, on_result=None, keep_results=True):
+        self.results = [None] * total
+        self.errors = []
+        self.on_result = on_result
+        self.keep_results = keep_results
+        self._pending = {}
+        self._next_index = 0
+
+    def add(self, chunk_results):
+        for index, result, error in chunk_results:
+            if error:
+                self.errors.append((index, error))
+            if self.on_result is None:
+                if self.keep_results:
+                    self.results[index] = result
+                continue
+            self._pending[index] = result
+        while self._next_index in self._pending:
+            result = self._pending.pop(self._next_index)
+            if self.keep_results:
+                self.results[self._next_index] = result
+            self.on_result(self._next_index, result)
+            self._next_index += 1
+
+
+def parallel_map(func, tasks, context=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None,
+                 on_result=None, keep_results=True, batch_func=None):
+    # Returns (results, errors): results[i] is the output of tasks[i] (None if it
+    # failed) and errors is a list of (index, message) sorted by index.
+    # progress, if given, is called as progress(done, total) after every chunk.
+    # on_result, if given, is called as on_result(index, result) in task order
+    # as soon as each result (and every one before it) is available; pass
+    # keep_results=False to stream results without holding them all in memory.
+    tasks = list(tasks)
+    total = len(tasks)
+    collected = _OrderedResults(total, on_result, keep_results)
+    workers = workers or default_workers()
+
+    if workers <= 1 or total <= 1:
+        func = resolve_func(func)
+        batch_func = resolve_func(batch_func) if batch_func else None
+        for start, chunk in chunked(tasks, chunk_size):
+            collected.add(_run_chunk(start, chunk, func, batch_func, context))
+            if progress:
+                progress(min(start + len(chunk), total), total)
+        return collected.results, collected.errors
+
+    # The pool hands out whole chunks; keep them small enough that every worker gets one
+    chunk_size = min(chunk_size, max(1, math.ceil(total / workers)))
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(), initializer=_init_worker,
+                             initargs=(func, context, metrics_enabled(), batch_func)) as executor:
+        futures = [executor.submit(_run_chunk_in_worker, start, chunk) for start, chunk in chunked(tasks, chunk_size)]
+        for future in as_completed(futures):
+            chunk_results, metrics = future.result()
+            if metrics and current_metrics() is not None:
+                current_metrics().merge(metrics)
+            collected.add(chunk_results)
+            done += len(chunk_results)
+            if progress:
+                progress(done, total)
+
+    collected.errors.sort()
+    return collected.results, collected.errors
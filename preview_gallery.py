@@ -0,0 +1,30 @@
+import streamlit as st
+
+# Grid of placeholders that fill in as creatives finish rendering.
+#
+# The slots are laid out before the render starts, so the first creatives
+# show up while the rest of the batch is still being drawn and encoded (see
+# render_pipeline.py) instead of after the last one. Only the first
+# PREVIEW_SLOTS creatives are previewed; everything goes into the download.
+
+PREVIEW_SLOTS = 12
+PREVIEW_COLUMNS = 4
+
+
+class PreviewGallery:
+    def __init__(self, total, slots=PREVIEW_SLOTS, columns=PREVIEW_COLUMNS):
+        count = min(total, slots)
+        self.placeholders = []
+        if count:
+            grid = st.columns(min(columns, count))
+            # Filled row by row
+            self.placeholders = [grid[slot % len(grid)].empty() for slot in range(count)]
+            for placeholder in self.placeholders:
+                placeholder.caption("Rendering...")
+        self.shown = 0
+
+    def show(self, image, caption=None):
+        # image may be a PIL image or encoded PNG/JPEG bytes
+        if self.shown < len(self.placeholders):
+            self.placeholders[self.shown].image(image, caption=caption, use_column_width=True)
+            self.shown += 1
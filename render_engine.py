@@ -0,0 +1,386 @@
+import json
+import os
+from io import BytesIO
+from PIL import Image, ImageDraw
+import batch_composite
+from encoders import encode_for_size, manifest_entry
+from font_registry import DEFAULT_FONT_PATH, get_font
+from sprite_cache import font_key, sprite_cache
+from text_metrics import font_text_size
+from image_cache import largest_dimensions, source_cache
+from instrumentation import count, stage
+from layout_templates import DEFAULT_TEMPLATE
+from logo_assets import get_logo_asset
+from render_memo import RenderMemo, canonical_hash, memoized_map, variant_key
+
+# Pure compositing engine shared by the Streamlit apps and the batch CLI.
+# Nothing in here touches Streamlit: a variant spec and a base image go in,
+# a Pillow image comes out.
+
+DEFAULT_FONT_SIZE = 20
+
+IMAGE_SIZES = {
+    "IP Targeting": {
+        "300x250": (300, 250),
+        "728x90": (728, 90),
+    },
+    "Mobile Footprinting": {
+        "300x250": (300, 250),
+        "728x90": (728, 90),
+    },
+    "Audience Select": {
+        "300x250": (300, 250),
+        "728x90": (728, 90),
+    },
+    "Spotify": {
+        "640x640": (640, 640),
+        "300x250": (300, 250),
+    },
+    "YouTube": {
+        "1280x720": (1280, 720),
+        "300x250": (300, 250),
+    },
+}
+
+# Padding between the text and the edge of its background box
+TEXT_PADDING = (10, 5)
+
+# Variants per worker chunk in render_campaign; a chunk's same-size creatives
+# are composited together (render_variant_files)
+BATCH_CHUNK_SIZE = 32
+
+
+def load_font(font_size=DEFAULT_FONT_SIZE, font_path=DEFAULT_FONT_PATH):
+    return get_font(font_size, font_path)
+
+
+def measure_text(draw, text, font):
+    return font_text_size(text, font)
+
+
+def draw_text_box(draw, text, position, font, text_color, bg_color, text_shape="Rectangle"):
+    text_width, text_height = measure_text(draw, text, font)
+    pad_x, pad_y = TEXT_PADDING
+    box = [position, (position[0] + text_width + 2 * pad_x, position[1] + text_height + 2 * pad_y)]
+
+    if text_shape == "Pill-shaped":
+        radius = (text_height + 2 * pad_y) // 2
+        draw.rounded_rectangle(box, radius=radius, fill=bg_color, outline=bg_color)
+    else:
+        draw.rectangle(box, fill=bg_color, outline=bg_color)
+    draw.text((position[0] + pad_x, position[1] + pad_y), text, fill=text_color, font=font)
+
+
+def text_box_sprite(text, font, text_color, bg_color, text_shape="Rectangle"):
+    # The box drawn by draw_text_box on a transparent canvas, rendered once per style
+    key = (text, font_key(font), text_color, bg_color, text_shape)
+
+    def render():
+        text_width, text_height = font_text_size(text, font)
+        _, _, right, bottom = font.getbbox(text)
+        pad_x, pad_y = TEXT_PADDING
+        # Ink can hang past the box by the glyph offset, so size the canvas for both
+        canvas_size = (max(text_width, right) + 2 * pad_x + 1, max(text_height, bottom) + 2 * pad_y + 1)
+        sprite = Image.new("RGBA", canvas_size, (0, 0, 0, 0))
+        draw_text_box(ImageDraw.Draw(sprite), text, (0, 0), font, text_color, bg_color, text_shape)
+        return sprite
+
+    return sprite_cache.get(key, render)
+
+
+def creative_layers(size, variant, logo_asset=None, font=None, template=DEFAULT_TEMPLATE):
+    # The (sprite, position) overlays of one creative, in paint order; sprites
+    # come from shared caches, so variants with the same text get the same objects
+    font = font or load_font()
+    text_shape = variant.get('text_shape', "Rectangle")
+    placements = template.compile(size)
+
+    cta_sprite = text_box_sprite(variant['call_to_action_text'], font,
+                                 variant['cta_text_color'], variant['cta_bg_color'], text_shape)
+    desc_sprite = text_box_sprite(variant['description_text'], font,
+                                  variant['desc_text_color'], variant['desc_bg_color'], text_shape)
+    layers = [
+        (cta_sprite, placements['cta'].place(cta_sprite.size)),
+        (desc_sprite, placements['desc'].place(desc_sprite.size)),
+    ]
+    if logo_asset is not None:
+        logo_resized = logo_asset.scaled(placements['logo'].box)
+        layers.append((logo_resized, placements['logo'].place(logo_resized.size)))
+    return layers
+
+
+def render_creative(base_image, variant, logo_asset=None, font=None, template=DEFAULT_TEMPLATE):
+    # base_image is expected to already be resized to the variant's dimensions;
+    # elements are placed by the template compiled for that size
+    img = base_image.copy()
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    for sprite, position in creative_layers(img.size, variant, logo_asset, font, template):
+        img.paste(sprite, position, sprite)
+    return img
+
+
+def render_creatives(base_images, variants, logo_asset=None, font=None, template=DEFAULT_TEMPLATE):
+    # render_creative for a batch: RGB bases of the same size are composited
+    # together with NumPy when it is installed (see batch_composite.py)
+    results = [None] * len(variants)
+    groups = {}
+    for index, base_image in enumerate(base_images):
+        if batch_composite.available() and base_image.mode == "RGB":
+            groups.setdefault(base_image.size, []).append(index)
+        else:
+            results[index] = render_creative(base_image, variants[index], logo_asset, font, template)
+
+    for size, indexes in groups.items():
+        if len(indexes) == 1:
+            results[indexes[0]] = render_creative(base_images[indexes[0]], variants[indexes[0]], logo_asset, font, template)
+            continue
+        layers = [creative_layers(size, variants[index], logo_asset, font, template) for index in indexes]
+        composited = batch_composite.composite_batch([base_images[index] for index in indexes], layers)
+        for index, image in zip(indexes, composited):
+            results[index] = image
+    return results
+
+
+def with_opacity(image, opacity):
+    # Copy of an RGBA image with its alpha scaled by opacity (0-1)
+    if opacity >= 1:
+        return image
+    faded = image.copy()
+    faded.putalpha(image.getchannel("A").point(lambda alpha: round(alpha * max(opacity, 0))))
+    return faded
+
+
+def layout_box(element, scale):
+    # Editor rectangle (CSS pixels) -> (left, top, width, height) in image pixels
+    return (round(element['x'] / scale), round(element['y'] / scale),
+            max(1, round(element['width'] / scale)), max(1, round(element['height'] / scale)))
+
+
+def layout_text_sprite(text, element, scale, text_color, bg_color, text_shape, font_path=DEFAULT_FONT_PATH):
+    # The editor's text box redrawn at image scale: same box, font size and opacity
+    _, _, width, height = layout_box(element, scale)
+    font = get_font(max(1, round(element['font_size'] / scale)), font_path)
+    sprite = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(sprite)
+    if text_shape == "Pill-shaped":
+        draw.rounded_rectangle([(0, 0), (width - 1, height - 1)], radius=min(width, height) // 2, fill=bg_color)
+    else:
+        draw.rectangle([(0, 0), (width - 1, height - 1)], fill=bg_color)
+    # The editor centres the text inside its padding, so do the same
+    draw.text((width / 2, height / 2), text, fill=text_color, font=font, anchor="mm")
+    return with_opacity(sprite, element.get('opacity', 1))
+
+
+def render_from_layout(base_image, variant, layout, logo_asset=None, font_path=DEFAULT_FONT_PATH):
+    # Final render of a variant as arranged in the editor. layout holds the
+    # editor container size and, for 'cta', 'desc' and 'logo', the rectangle,
+    # opacity and font size the browser reported (see editor_component.py).
+    img = base_image.convert("RGBA")
+    # The background is drawn with background-size: contain from the top-left corner
+    editor_width, editor_height = layout['editor_size']
+    scale = min(editor_width / img.width, editor_height / img.height)
+    text_shape = variant.get('text_shape', "Rectangle")
+
+    for element_key, text_key, color_prefix in (('cta', 'call_to_action_text', 'cta'),
+                                                ('desc', 'description_text', 'desc')):
+        element = layout[element_key]
+        sprite = layout_text_sprite(variant[text_key], element, scale, variant[f'{color_prefix}_text_color'],
+                                    variant[f'{color_prefix}_bg_color'], text_shape, font_path)
+        left, top, _, _ = layout_box(element, scale)
+        img.alpha_composite(sprite, (max(left, 0), max(top, 0)))
+
+    if logo_asset is not None and layout.get('logo'):
+        left, top, width, height = layout_box(layout['logo'], scale)
+        logo = with_opacity(logo_asset.scaled((width, height)), layout['logo'].get('opacity', 1))
+        img.alpha_composite(logo, (max(left, 0), max(top, 0)))
+
+    return img.convert("RGB")
+
+
+def resolve_sizes(selected_sizes, image_sizes=IMAGE_SIZES):
+    # Accepts [channel, label] pairs or bare channel names (all sizes of that channel)
+    resolved = []
+    for entry in selected_sizes:
+        if isinstance(entry, str):
+            for label, dimensions in image_sizes[entry].items():
+                resolved.append((entry, label, dimensions))
+        else:
+            channel, label = entry[0], entry[1]
+            resolved.append((channel, label, tuple(image_sizes[channel][label])))
+    return resolved
+
+
+def text_pairs(call_to_action_texts, description_texts, mix_cta_desc):
+    if mix_cta_desc:
+        # Produce all combinations of CTA and Description
+        return [(cta, desc) for cta in call_to_action_texts for desc in description_texts]
+    return list(zip(call_to_action_texts, description_texts))
+
+
+def build_variants(campaign):
+    sizes = resolve_sizes(campaign['sizes'], campaign.get('image_sizes', IMAGE_SIZES))
+    colors = campaign.get('colors', {})
+    pairs = text_pairs(campaign['call_to_action_texts'], campaign['description_texts'],
+                       campaign.get('mix_cta_desc', False))
+
+    variants = []
+    for call_to_action_text, description_text in pairs:
+        for source_index, source in enumerate(campaign['images']):
+            for channel, label, dimensions in sizes:
+                variants.append({
+                    'source': source,
+                    'source_index': source_index,
+                    'channel': channel,
+                    'label': label,
+                    'dimensions': dimensions,
+                    'call_to_action_text': call_to_action_text,
+                    'description_text': description_text,
+                    'cta_bg_color': colors.get('cta_bg', "#000000"),
+                    'cta_text_color': colors.get('cta_text', "#FFFFFF"),
+                    'desc_bg_color': colors.get('desc_bg', "#000000"),
+                    'desc_text_color': colors.get('desc_text', "#FFFFFF"),
+                    'text_shape': campaign.get('text_shape', "Rectangle"),
+                })
+    return variants
+
+
+def variant_filename(index, variant, extension="png"):
+    return f"final_image_{index}.{extension}"
+
+
+# Keys a render task needs; everything else in the Streamlit images_data dicts
+# (previews, base64 strings) stays out of the worker processes
+VARIANT_KEYS = (
+    'source', 'source_index', 'channel', 'label', 'dimensions',
+    'call_to_action_text', 'description_text',
+    'cta_bg_color', 'cta_text_color', 'desc_bg_color', 'desc_text_color', 'text_shape',
+)
+
+
+def variant_task(data):
+    return {key: data.get(key) for key in VARIANT_KEYS}
+
+
+def render_context(campaign_or_settings, sources=None):
+    # Everything a render worker needs besides the variant itself
+    return {
+        'sources': sources,
+        'logo': campaign_or_settings.get('logo'),
+        'font_size': campaign_or_settings.get('font_size', DEFAULT_FONT_SIZE),
+        'font_path': campaign_or_settings.get('font_path', DEFAULT_FONT_PATH),
+        'output_format': campaign_or_settings.get('output_format', "Auto"),
+        'encoding_profiles': campaign_or_settings.get('encoding_profiles'),
+        # Largest output size; sources are decoded at reduced scale down to it
+        'decode_size': campaign_or_settings.get('decode_size'),
+        # Crop each size to its aspect ratio around the subject instead of stretching
+        'smart_crop': bool(campaign_or_settings.get('smart_crop', False)),
+    }
+
+
+def context_digest(context):
+    # Hash of every render setting that affects output pixels or encoding;
+    # source photos are hashed per variant instead (see render_memo.variant_key)
+    logo = context.get('logo')
+    settings = {key: value for key, value in context.items() if key not in ('sources', 'logo')}
+    return canonical_hash(settings, source_cache.source_key(logo) if logo else None)
+
+
+# Per-process state derived from a render context (decoded logo, font, sources)
+_prepared_contexts = {}
+
+
+def _prepare_context(context):
+    prepared = _prepared_contexts.get(id(context))
+    if prepared is None or prepared['context'] is not context:
+        sources = context.get('sources')
+        if sources:
+            # Wrap raw bytes once so the source cache can memoize their digest
+            sources = {index: BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+                       for index, data in sources.items()}
+        prepared = {
+            'context': context,
+            'font': load_font(context['font_size'], context['font_path']),
+            'logo': get_logo_asset(context['logo']) if context.get('logo') else None,
+            'sources': sources,
+        }
+        _prepared_contexts.clear()
+        _prepared_contexts[id(context)] = prepared
+    return prepared
+
+
+def render_variant_file(variant, context):
+    # Renders one variant and encodes it for its size (see encoders.encode_image
+    # for the returned dict)
+    prepared = _prepare_context(context)
+    source = variant['source']
+    if prepared['sources']:
+        source = prepared['sources'][variant['source_index']]
+    img_resized = source_cache.get_resized(source, variant['dimensions'], Image.LANCZOS, context.get('decode_size'),
+                                           crop=context.get('smart_crop', False))
+    with stage("draw"):
+        final_image = render_creative(img_resized, variant, prepared['logo'], prepared['font'])
+    with stage("encode"):
+        encoded = encode_for_size(final_image, variant['label'], context['output_format'], context['encoding_profiles'])
+    count("variants_rendered")
+    count("encoded_bytes", encoded['bytes'])
+    return encoded
+
+
+def render_variant_files(variants, context):
+    # Batch form of render_variant_file for parallel_map(batch_func=...)
+    prepared = _prepare_context(context)
+    bases = []
+    for variant in variants:
+        source = variant['source']
+        if prepared['sources']:
+            source = prepared['sources'][variant['source_index']]
+        bases.append(source_cache.get_resized(source, variant['dimensions'], Image.LANCZOS, context.get('decode_size'),
+                                              crop=context.get('smart_crop', False)))
+    with stage("draw"):
+        final_images = render_creatives(bases, variants, prepared['logo'], prepared['font'])
+
+    results = []
+    for variant, final_image in zip(variants, final_images):
+        with stage("encode"):
+            encoded = encode_for_size(final_image, variant['label'], context['output_format'], context['encoding_profiles'])
+        count("variants_rendered")
+        count("encoded_bytes", encoded['bytes'])
+        results.append(encoded)
+    return results
+
+
+def write_variant(output_dir, index, variant, encoded):
+    target_dir = os.path.join(output_dir, variant['channel'], variant['label'])
+    os.makedirs(target_dir, exist_ok=True)
+    path = os.path.join(target_dir, variant_filename(index, variant, encoded['extension']))
+    with open(path, "wb") as output_file:
+        output_file.write(encoded['data'])
+    return path
+
+
+def render_campaign(campaign, output_dir, workers=1, progress=None):
+    # Returns (written paths, [(variant index, error message)]) and records
+    # every creative's format, quality and size in output_dir/manifest.json
+    variants = build_variants(campaign)
+    written = []
+    manifest = []
+
+    def write_result(index, encoded):
+        if encoded is not None:
+            path = write_variant(output_dir, index, variants[index], encoded)
+            written.append(path)
+            manifest.append(manifest_entry(os.path.relpath(path, output_dir), encoded))
+
+    context = render_context(dict(campaign, decode_size=largest_dimensions(variant['dimensions'] for variant in variants)))
+    # Variants that differ only in channel (or repeat a text pair) are rendered once
+    settings_digest = context_digest(context)
+    keys = [variant_key(variant, source_cache.source_key(variant['source']), settings_digest) for variant in variants]
+    errors = memoized_map(RenderMemo(), keys, render_variant_file, variants, context,
+                          workers=workers, progress=progress, on_result=write_result,
+                          batch_func=render_variant_files, chunk_size=BATCH_CHUNK_SIZE)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return written, errors
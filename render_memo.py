@@ -0,0 +1,129 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from parallel_render import parallel_map
+
+# Memo of rendered variants keyed by a canonical hash of their inputs.
+#
+# Streamlit reruns the whole script on every widget change. Keeping finished
+# variants under a hash of everything that affects their pixels (text, colors,
+# shape, size, source and logo content, font and output settings) means a
+# rerun only renders the variants whose inputs actually changed. The apps
+# share one process-wide memo (shared_memo), so its budget caps the memory of
+# all sessions together; keys hash the content of every input, so a hit only
+# ever returns a creative with exactly the pixels the session asked for.
+#
+# The same key also deduplicates within one batch: the channel a creative is
+# filed under does not change its pixels, so a 300x250 selected under five
+# channels (or a repeated CTA/description pair) is rendered once and the
+# result fanned out to every task that shares its key.
+
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+
+
+def canonical_hash(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=list, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# Task fields that only say where a creative comes from or is filed
+LOCATION_KEYS = ('source', 'source_index', 'channel')
+
+
+def variant_key(task, source_digest, settings_digest):
+    # 'source' and 'source_index' only say where the photo came from (its
+    # content digest is what matters) and 'channel' only names the output folder
+    inputs = {key: value for key, value in task.items() if key not in LOCATION_KEYS}
+    return canonical_hash(inputs, source_digest, settings_digest)
+
+
+def result_nbytes(result):
+    if isinstance(result, dict) and 'data' in result:
+        return len(result['data'])
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    return 0
+
+
+class RenderMemo:
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            if key in self._results:
+                return
+            self._results[key] = result
+            self.current_bytes += result_nbytes(result)
+            while self.current_bytes > self.budget_bytes and len(self._results) > 1:
+                _, evicted = self._results.popitem(last=False)
+                self.current_bytes -= result_nbytes(evicted)
+
+
+def memoized_map(memo, keys, func, tasks, context=None, on_result=None, progress=None, **parallel_options):
+    # parallel_map over one task per distinct key that is not in the memo.
+    # on_result still sees every task, in order, with memoized and shared
+    # results interleaved. Returns the list of (index, error message) for
+    # tasks that failed.
+    first_index = {}
+    last_index = {}
+    for index, key in enumerate(keys):
+        first_index.setdefault(key, index)
+        last_index[key] = index
+    resolved = {key: memo.get(key) for key in first_index}
+    pending = [index for key, index in first_index.items() if resolved[key] is None]
+    total = len(tasks)
+    emitted = [0]
+
+    def emit_until(stop):
+        while emitted[0] < stop:
+            index = emitted[0]
+            key = keys[index]
+            if on_result:
+                on_result(index, resolved[key])
+            if last_index[key] == index:
+                # Every task with this key has its result; let it go
+                del resolved[key]
+            emitted[0] += 1
+
+    def handle_result(position, result):
+        index = pending[position]
+        emit_until(index)
+        if result is not None:
+            memo.put(keys[index], result)
+        resolved[keys[index]] = result
+        emit_until(index + 1)
+
+    def report_progress(done, _):
+        if progress:
+            progress(total - len(pending) + done, total)
+
+    if progress and not pending:
+        progress(total, total)
+    _, errors = parallel_map(func, [tasks[index] for index in pending], context,
+                             progress=report_progress, on_result=handle_result, keep_results=False,
+                             **parallel_options)
+    emit_until(total)
+    failed = {keys[pending[position]]: message for position, message in errors}
+    return [(index, failed[key]) for index, key in enumerate(keys) if key in failed]
+
+
+# Process-wide memo shared by every Streamlit session
+shared_memo = RenderMemo()
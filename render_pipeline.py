@@ -0,0 +1,126 @@
+import contextvars
+import queue
+import threading
+import traceback
+
+from instrumentation import stage
+
+# Threaded render -> encode -> publish pipeline.
+#
+# Each step runs in its own threads and hands its output to the next step
+# through a bounded queue. Drawing the next creative overlaps with encoding the
+# previous one: Pillow releases the GIL while it resamples, deflates PNGs
+# (zlib) and encodes JPEGs. A slow consumer holds the producers back instead
+# of letting finished images pile up in memory.
+#
+# Publishing runs in the calling thread, since Streamlit only takes UI updates
+# from the script thread. It sees results in task order as soon as each one
+# (and every one before it) is done, so the first creatives show up while the
+# rest are still rendering. A failing task is recorded as an error for its
+# index, as in parallel_render, and skips the remaining steps. The threads run
+# in copies of the caller's context, so stages are timed in its metrics job.
+
+DEFAULT_QUEUE_SIZE = 8
+
+# How often blocked threads check whether the run was abandoned
+_POLL_SECONDS = 0.1
+_DONE = object()
+
+
+def _error_message(error):
+    return "".join(traceback.format_exception_only(type(error), error)).strip()
+
+
+def pipeline_map(tasks, steps, on_result, workers=1, queue_size=DEFAULT_QUEUE_SIZE, progress=None):
+    # steps: [(name, func)] applied in order, each func(value) -> next value
+    # and timed as an instrumentation stage under its name; every step gets
+    # `workers` threads. on_result(index, result) publishes the output of the
+    # last step. progress, if given, is called as progress(done, total).
+    # Returns the errors as [(index, message)] sorted by index.
+    tasks = list(tasks)
+    total = len(tasks)
+    queues = [queue.Queue(max(queue_size, workers)) for _ in range(len(steps) + 1)]
+    cancelled = threading.Event()
+
+    def put(target, item):
+        while not cancelled.is_set():
+            try:
+                target.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(source):
+        while not cancelled.is_set():
+            try:
+                return source.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def feed():
+        for index, task in enumerate(tasks):
+            if not put(queues[0], (index, task, None)):
+                return
+        for _ in range(workers):
+            put(queues[0], _DONE)
+
+    def run_step(position, name, func, remaining):
+        inbox, outbox = queues[position], queues[position + 1]
+        while True:
+            item = get(inbox)
+            if item is _DONE:
+                # The last thread of a step out tells the next step's threads to stop
+                with remaining['lock']:
+                    remaining['threads'] -= 1
+                    last = remaining['threads'] == 0
+                if last and position + 1 < len(steps):
+                    for _ in range(workers):
+                        put(outbox, _DONE)
+                return
+            index, value, error = item
+            if error is None:
+                try:
+                    with stage(name):
+                        value = func(value)
+                except Exception as exc:
+                    value, error = None, _error_message(exc)
+            if not put(outbox, (index, value, error)):
+                return
+
+    def start(target, *args):
+        # A context can only be entered by one thread at a time
+        return threading.Thread(target=contextvars.copy_context().run, args=(target, *args), daemon=True)
+
+    threads = [start(feed)]
+    for position, (name, func) in enumerate(steps):
+        remaining = {'threads': workers, 'lock': threading.Lock()}
+        threads.extend(start(run_step, position, name, func, remaining) for _ in range(workers))
+    for thread in threads:
+        thread.start()
+
+    errors = []
+    pending = {}
+    next_index = 0
+    try:
+        for done in range(1, total + 1):
+            index, result, error = queues[-1].get()
+            if error:
+                errors.append((index, error))
+            pending[index] = (result, error)
+            while next_index in pending:
+                result, error = pending.pop(next_index)
+                if not error:
+                    on_result(next_index, result)
+                next_index += 1
+            if progress:
+                progress(done, total)
+    finally:
+        # Lets the threads exit if publishing failed part-way
+        cancelled.set()
+        for thread in threads:
+            thread.join()
+
+    errors.sort()
+    return errors
@@ -0,0 +1,76 @@
+from PIL import Image, ImageChops, ImageFilter, ImageOps, ImageStat
+
+# Saliency-guided cropping to each ad size's aspect ratio.
+#
+# Stretching a landscape photo to 728x90 or 640x640 distorts it, and fitting
+# it inside the box letterboxes it. Instead every output takes the largest
+# window of its aspect ratio from the photo, slid along the free axis to where
+# the photo is most "interesting".
+#
+# The analysis runs once per photo on a copy no larger than ANALYSIS_SIZE:
+# edge density plus colour distance from the photo's mean colour, blurred and
+# weighted slightly towards the centre. image_cache.SourceCache keeps the
+# resulting map next to the decoded photo, so crops for every size are a
+# couple of passes over a few thousand pixels.
+
+ANALYSIS_SIZE = 64
+
+# Aspect ratios closer than this to the photo's are not worth cropping
+MIN_CROP_FRACTION = 0.99
+
+
+def saliency_map(image):
+    # "L" image of at most ANALYSIS_SIZE on its longer side; brighter is more salient
+    small = image.convert("RGB")
+    small.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.BILINEAR)
+
+    edges = small.convert("L").filter(ImageFilter.FIND_EDGES)
+    # The filter leaves the outermost pixels unfiltered; they are not edges
+    edges = ImageOps.expand(edges.crop((1, 1, edges.width - 1, edges.height - 1)), border=1, fill=0)
+    mean_colour = tuple(round(value) for value in ImageStat.Stat(small).mean)
+    colour = ImageChops.difference(small, Image.new("RGB", small.size, mean_colour)).convert("L")
+
+    saliency = ImageChops.add(edges, colour, scale=2).filter(ImageFilter.GaussianBlur(2))
+    # Centre prior: weights fall from 1 in the middle to 0.75 in the corners
+    centre = ImageOps.invert(Image.radial_gradient("L").resize(small.size)).point(lambda value: 192 + value // 4)
+    return ImageOps.autocontrast(ImageChops.multiply(saliency, centre))
+
+
+def crop_box(saliency, size, dimensions):
+    # (left, top, right, bottom) of the window of the photo (size) with the
+    # aspect ratio of dimensions that holds the most saliency, or None when
+    # the aspect ratios already match
+    width, height = size
+    aspect = dimensions[0] / dimensions[1]
+    if width / height > aspect:
+        crop_width, crop_height = height * aspect, height
+    else:
+        crop_width, crop_height = width, width / aspect
+    if crop_width >= width * MIN_CROP_FRACTION and crop_height >= height * MIN_CROP_FRACTION:
+        return None
+
+    map_width, map_height = saliency.size
+    values = saliency.tobytes()
+    if crop_width < width:
+        # Slide horizontally over the column totals
+        profile = [sum(values[x::map_width]) for x in range(map_width)]
+        left = _best_offset(profile, crop_width / width, width)
+        return left, 0, left + crop_width, height
+    profile = [sum(values[y * map_width:(y + 1) * map_width]) for y in range(map_height)]
+    top = _best_offset(profile, crop_height / height, height)
+    return 0, top, width, top + crop_height
+
+
+def _best_offset(profile, fraction, length):
+    # Start (in photo pixels) of the window covering fraction of the axis
+    # whose profile total is highest; ties go to the most central window
+    span = max(1, round(fraction * len(profile)))
+    totals = [0]
+    for value in profile:
+        totals.append(totals[-1] + value)
+    centre = (len(profile) - span) / 2
+    best = max(range(len(profile) - span + 1),
+               key=lambda start: (totals[start + span] - totals[start], -abs(start - centre)))
+    window = fraction * length
+    middle = (best + span / 2) / len(profile) * length
+    return min(max(middle - window / 2, 0), length - window)
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+
+# Pre-rendered CTA / description boxes.
+#
+# A text box with the same text, font, colors and shape looks identical on every
+# background, so it is drawn once onto a transparent RGBA sprite, cached under
+# its full style key, and then pasted onto each resized base with its alpha as
+# the mask (see render_engine.text_box_sprite).
+
+MAX_CACHED_SPRITES = 512
+
+
+def font_key(font):
+    # Registry fonts carry (path, size); anything else is keyed by identity
+    return getattr(font, "registry_key", None) or ("font", id(font))
+
+
+class SpriteCache:
+    def __init__(self, max_sprites=MAX_CACHED_SPRITES):
+        self.max_sprites = max_sprites
+        self.hits = 0
+        self.misses = 0
+        self._sprites = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+
+        sprite = render()
+        with self._lock:
+            self._sprites[key] = sprite
+            if len(self._sprites) > self.max_sprites:
+                self._sprites.popitem(last=False)
+        return sprite
+
+    def clear(self):
+        with self._lock:
+            self._sprites.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+sprite_cache = SpriteCache()
+
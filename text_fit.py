@@ -0,0 +1,67 @@
+from font_registry import DEFAULT_FONT_PATH
+from text_metrics import text_bbox
+
+# Finds the largest font size whose rendered text fits a width/height box.
+#
+# Text extent grows almost linearly with font size, so one measurement at a
+# reference size gives a close first guess. Hinting and rounding make the
+# relationship not quite exact, so the guess is then bracketed with doubling
+# steps and settled with a binary search; this typically costs 3-6
+# measurements instead of one per pixel size. Measurements come from the
+# text_metrics glyph tables, so no FreeType font is loaded per candidate size.
+
+MIN_FONT_SIZE = 1
+MAX_FONT_SIZE = 500
+REFERENCE_FONT_SIZE = 100
+
+
+def measure_text_size(text, font_size, font_path=DEFAULT_FONT_PATH):
+    # Same extent draw.textsize used to report: right/bottom edge of the text
+    # when drawn at the origin
+    _, _, right, bottom = text_bbox(text, font_size, font_path)
+    return right, bottom
+
+
+def fit_font_size(text, max_width, max_height, font_path=DEFAULT_FONT_PATH,
+                  min_size=MIN_FONT_SIZE, max_size=MAX_FONT_SIZE):
+    def fits(font_size):
+        text_width, text_height = measure_text_size(text, font_size, font_path)
+        return text_width <= max_width and text_height <= max_height
+
+    ref_width, ref_height = measure_text_size(text, REFERENCE_FONT_SIZE, font_path)
+    if ref_width <= 0 or ref_height <= 0:
+        return max_size
+
+    scale = min(max_width / ref_width, max_height / ref_height)
+    guess = min(max(int(REFERENCE_FONT_SIZE * scale), min_size), max_size)
+
+    # Bracket the answer: low always fits (or is min_size), high never does
+    step = 1
+    if fits(guess):
+        low, high = guess, guess + step
+        while high <= max_size and fits(high):
+            low = high
+            step *= 2
+            high = low + step
+        if high > max_size:
+            if fits(max_size):
+                return max_size
+            high = max_size
+    else:
+        high, low = guess, guess - step
+        while low > min_size and not fits(low):
+            high = low
+            step *= 2
+            low = high - step
+        if low <= min_size:
+            if not fits(min_size):
+                return min_size
+            low = min_size
+
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle
+    return low
@@ -0,0 +1,154 @@
+import math
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw
+
+from font_registry import DEFAULT_FONT_PATH, font_registry
+
+# Glyph-advance measurement engine.
+#
+# Each glyph is measured once per font size: its hinted advance and ink box,
+# plus kerning for every glyph pair we come across. Extents of a string are
+# summed from those, so no text is laid out or rasterized per variant. Results
+# are memoized per (text, font path, size).
+#
+# The box follows draw.textbbox: it spans the whole pen advance, so leading
+# and trailing spaces count, and a string with no ink is an empty band on the
+# ascender line. Hinted metrics make the box match Pillow's; where they do
+# not, right is ceiled so the estimate errs on the side of a larger box.
+# Multiline text is measured by Pillow itself.
+
+MAX_CACHED_EXTENTS = 20000
+
+
+class GlyphTable:
+    def __init__(self, font_path=DEFAULT_FONT_PATH):
+        self.font_path = font_path
+        self._glyphs = {}
+        self._kerning = {}
+        self._ascenders = {}
+        self._lock = threading.Lock()
+
+    def _font(self, font_size):
+        return font_registry.get_font(font_size, self.font_path)
+
+    def glyph(self, char, font_size):
+        key = (char, font_size)
+        metrics = self._glyphs.get(key)
+        if metrics is None:
+            font = self._font(font_size)
+            advance = font.getlength(char)
+            left, top, right, bottom = font.getbbox(char)
+            # Whitespace has advance but no ink
+            has_ink = right > left and bottom > top
+            metrics = (advance, left, top, right, bottom, has_ink)
+            with self._lock:
+                self._glyphs[key] = metrics
+        return metrics
+
+    def kerning(self, first, second, font_size):
+        key = (first + second, font_size)
+        adjustment = self._kerning.get(key)
+        if adjustment is None:
+            adjustment = (self._font(font_size).getlength(first + second)
+                          - self.glyph(first, font_size)[0] - self.glyph(second, font_size)[0])
+            with self._lock:
+                self._kerning[key] = adjustment
+        return adjustment
+
+    def ascender(self, font_size):
+        ascender = self._ascenders.get(font_size)
+        if ascender is None:
+            # Where Pillow puts the top of text that has no ink
+            ascender = self._font(font_size).getbbox(" ")[1]
+            with self._lock:
+                self._ascenders[font_size] = ascender
+        return ascender
+
+    def bbox(self, text, font_size):
+        # Box of single-line text drawn at the origin at font_size, as
+        # draw.textbbox reports it, plus the pen advance
+        pen = 0
+        left = top = math.inf
+        right = bottom = -math.inf
+        previous = None
+        for char in text:
+            if previous is not None:
+                pen += self.kerning(previous, char, font_size)
+            advance, glyph_left, glyph_top, glyph_right, glyph_bottom, has_ink = self.glyph(char, font_size)
+            if has_ink:
+                left = min(left, pen + glyph_left)
+                top = min(top, glyph_top)
+                right = max(right, pen + glyph_right)
+                bottom = max(bottom, glyph_bottom)
+            pen += advance
+            previous = char
+        if not text:
+            return (0, 0, 0, 0), 0
+        if left == math.inf:
+            ascender = self.ascender(font_size)
+            return (0, ascender, math.ceil(pen), ascender), pen
+        return (min(0, math.floor(left)), math.floor(top), math.ceil(max(pen, right)), math.ceil(bottom)), pen
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+_extents = OrderedDict()
+_extents_lock = threading.Lock()
+
+
+def glyph_table(font_path=DEFAULT_FONT_PATH):
+    table = _tables.get(font_path)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(font_path)
+            if table is None:
+                table = _tables[font_path] = GlyphTable(font_path)
+    return table
+
+
+def text_bbox(text, font_size, font_path=DEFAULT_FONT_PATH):
+    # Equivalent of draw.textbbox((0, 0), text, font=get_font(font_size, font_path))
+    key = (text, font_path, font_size)
+    with _extents_lock:
+        bbox = _extents.get(key)
+        if bbox is not None:
+            _extents.move_to_end(key)
+            return bbox
+
+    if "\n" in text:
+        # Line spacing and alignment are Pillow's business
+        font = font_registry.get_font(font_size, font_path)
+        bbox = ImageDraw.Draw(Image.new("L", (1, 1))).multiline_textbbox((0, 0), text, font=font)
+    else:
+        bbox, _ = glyph_table(font_path).bbox(text, font_size)
+
+    with _extents_lock:
+        _extents[key] = bbox
+        if len(_extents) > MAX_CACHED_EXTENTS:
+            _extents.popitem(last=False)
+    return bbox
+
+
+def text_length(text, font_size, font_path=DEFAULT_FONT_PATH):
+    # Pen advance of the whole string, i.e. font.getlength(text)
+    _, advance = glyph_table(font_path).bbox(text, font_size)
+    return advance
+
+
+def text_size(text, font_size, font_path=DEFAULT_FONT_PATH):
+    # (width, height) of the ink box
+    left, top, right, bottom = text_bbox(text, font_size, font_path)
+    return right - left, bottom - top
+
+
+def font_text_size(text, font):
+    # Measures with the glyph tables when the font came from the registry,
+    # otherwise falls back to asking Pillow
+    key = getattr(font, "registry_key", None)
+    if key is not None:
+        font_path, font_size = key
+        return text_size(text, font_size, font_path)
+    left, top, right, bottom = font.getbbox(text)
+    return right - left, bottom - top
@@ -0,0 +1,77 @@
+from io import BytesIO
+
+import streamlit as st
+from PIL import Image
+
+from image_cache import decode_reduced, read_source_bytes, source_cache
+from media_store import media_url
+
+# Upload ingestion, once per upload per session.
+#
+# Streamlit reruns the whole script on every widget change, and the uploaders
+# hand back the same files each time. Each upload is hashed and normalized
+# (EXIF orientation, RGB/RGBA mode) the first time it is seen; the preview and
+# the logo PNG are kept in st.session_state so later reruns only look them up.
+# Uploads with the same content as an earlier one are dropped, so duplicates do
+# not multiply the number of variants.
+
+PREVIEW_SIZE = (800, 800)
+
+
+def upload_id(upload):
+    # Streamlit keeps file_id stable across reruns for the same upload
+    return getattr(upload, "file_id", None) or (upload.name, upload.size)
+
+
+def _encode_preview(image):
+    preview = image.copy()
+    preview.thumbnail(PREVIEW_SIZE)
+    buffered = BytesIO()
+    if preview.mode == "RGBA":
+        preview.save(buffered, format="PNG")
+    else:
+        preview.save(buffered, format="JPEG", quality=85)
+    return buffered.getvalue()
+
+
+def ingest_images(uploads, key="ingested_images"):
+    # Returns (unique uploads in upload order, their previews, names of the
+    # duplicates that were dropped)
+    previous = st.session_state.get(key, {})
+    entries = {}
+    unique, previews, duplicates = [], [], []
+    seen = set()
+    for upload in uploads or []:
+        entry = previous.get(upload_id(upload))
+        if entry is None:
+            image = decode_reduced(Image.open(BytesIO(read_source_bytes(upload))), PREVIEW_SIZE)
+            entry = {
+                'digest': source_cache.source_key(upload),
+                'name': upload.name,
+                'preview': _encode_preview(image),
+            }
+        entries[upload_id(upload)] = entry
+        if entry['digest'] in seen:
+            duplicates.append(upload.name)
+            continue
+        seen.add(entry['digest'])
+        unique.append(upload)
+        previews.append(entry['preview'])
+    # Only keep uploads that are still in the uploader
+    st.session_state[key] = entries
+    return unique, previews, duplicates
+
+
+def ingest_logo(upload, key="ingested_logo"):
+    # Returns (media URL of the logo as an RGBA PNG, PNG bytes), or (None, None)
+    if not upload:
+        st.session_state.pop(key, None)
+        return None, None
+    entry = st.session_state.get(key)
+    if entry is None or entry['id'] != upload_id(upload):
+        logo = decode_reduced(Image.open(BytesIO(read_source_bytes(upload)))).convert("RGBA")
+        buffered = BytesIO()
+        logo.save(buffered, format="PNG")
+        entry = st.session_state[key] = {'id': upload_id(upload), 'png': buffered.getvalue()}
+    # Publishing is a hash and a dict lookup once the blob is in the media store
+    return media_url(entry['png'], "image/png"), entry['png']
@@ -0,0 +1,94 @@
+import os
+
+# Variant matrix planning.
+#
+# The apps cross every photo, text pair, position layout and ad size, which
+# grows fast: a few photos with all nine positions selected for each element
+# is already tens of thousands of creatives. The planner enumerates only the
+# layouts that are actually rendered (CTA, description and logo never share a
+# position), estimates the render time and memory of the batch from its pixel
+# counts, and checks it against caps so the app can refuse a runaway batch
+# before any work starts.
+#
+# Caps (environment variables):
+#   ADCREATIVE_MAX_VARIANTS     most creatives one request may render (default 5000)
+#   ADCREATIVE_MAX_MEMORY_MB    most memory a batch may be estimated to hold (default 2048)
+
+DEFAULT_MAX_VARIANTS = 5000
+DEFAULT_MAX_MEMORY_MB = 2048
+
+# Rough costs measured on photo uploads: compositing plus encoding, per output pixel
+SECONDS_PER_MEGAPIXEL = 0.02
+BYTES_PER_PIXEL = 3
+
+
+def max_variants():
+    return int(os.environ.get("ADCREATIVE_MAX_VARIANTS", DEFAULT_MAX_VARIANTS))
+
+
+def max_memory_bytes():
+    return int(os.environ.get("ADCREATIVE_MAX_MEMORY_MB", DEFAULT_MAX_MEMORY_MB)) * 1024 * 1024
+
+
+def position_layouts(cta_positions, desc_positions, logo_positions):
+    # (cta, desc, logo) position triples with no two elements in the same spot,
+    # in the order the nested position loops produce them
+    layouts = []
+    for cta_position in cta_positions:
+        for desc_position in desc_positions:
+            if desc_position == cta_position:
+                continue
+            for logo_position in logo_positions:
+                if logo_position != cta_position and logo_position != desc_position:
+                    layouts.append((cta_position, desc_position, logo_position))
+    return layouts
+
+
+def plan_variants(num_sources, num_text_pairs, num_layouts, sizes, render_size=None, workers=1):
+    # sizes are the (width, height) of every selected ad size. Without
+    # render_size each creative is composited at its ad size from a shared
+    # resized photo; with it, each layout is composited once at render_size,
+    # kept, and then resized to every ad size (OLDads5).
+    sizes = list(sizes)
+    composites = num_sources * num_text_pairs * num_layouts
+    variants = composites * len(sizes)
+    output_pixels = composites * sum(width * height for width, height in sizes)
+
+    if render_size:
+        render_pixels = composites * render_size[0] * render_size[1]
+        held_pixels = render_pixels
+    else:
+        render_pixels = 0
+        held_pixels = num_sources * sum(width * height for width, height in sizes)
+
+    plan = {
+        'variants': variants,
+        'seconds': (output_pixels + render_pixels) / 1e6 * SECONDS_PER_MEGAPIXEL / max(workers, 1),
+        'memory_bytes': held_pixels * BYTES_PER_PIXEL,
+    }
+    plan['over_limits'] = check_limits(plan)
+    return plan
+
+
+def check_limits(plan):
+    # Messages for every cap the plan exceeds; empty when it may run
+    problems = []
+    if plan['variants'] > max_variants():
+        problems.append(f"{plan['variants']} creatives exceeds the limit of {max_variants()} per request")
+    if plan['memory_bytes'] > max_memory_bytes():
+        problems.append(f"estimated {format_bytes(plan['memory_bytes'])} exceeds the "
+                        f"{format_bytes(max_memory_bytes())} memory limit")
+    return problems
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def describe_plan(plan):
+    return (f"{plan['variants']} creatives, about {plan['seconds']:.0f} s to render "
+            f"and {format_bytes(plan['memory_bytes'])} of images in memory")
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import zipfile
+
+# Incremental "Download all" archive.
+#
+# Creatives are appended one at a time as they finish rendering and go straight
+# to a temporary file on disk, so memory use stays flat no matter how many
+# variants a campaign has. PNG/JPEG/WebP data is already compressed and is
+# stored as-is; anything else is deflated.
+
+ALREADY_COMPRESSED = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".zip")
+
+# Keep small archives in memory, spill to disk past this size
+SPOOL_LIMIT_BYTES = 8 * 1024 * 1024
+
+
+def archive_path(*parts):
+    # e.g. archive_path("Spotify", "640x640", "final_image_3.png") -> "Spotify/640x640/final_image_3.png"
+    return "/".join(part.replace("/", "_") for part in parts)
+
+
+class ZipExport:
+    def __init__(self, spool_limit=SPOOL_LIMIT_BYTES):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_limit)
+        self._zip = zipfile.ZipFile(self._file, "w")
+        self.count = 0
+
+    def add(self, path, data):
+        if os.path.splitext(path)[1].lower() in ALREADY_COMPRESSED:
+            compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = zipfile.ZIP_DEFLATED
+        self._zip.writestr(path, data, compress_type=compress_type)
+        self.count += 1
+
+    def add_variant(self, channel, label, filename, data):
+        self.add(archive_path(channel, label, filename), data)
+
+    def finish(self):
+        # Returns the finished archive as bytes; st.download_button does not
+        # accept the spooled temporary file itself
+        self._zip.close()
+        self._file.seek(0)
+        return self._file.read()
+
+    def close(self):
+        self._zip.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()